@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2010 Arthur Furlan <afurlan@afurlan.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or any later version.
+#
+# On Debian systems, you can find the full text of the license in
+# /usr/share/common-licenses/GPL-2
+
+import sys
+from logbook import LogBook, ProjectDoesNotExistError
+
+# publish settings
+PUBLISH_DIR = '/var/www/logbook'
+
+if __name__ == '__main__':
+
+    # publish the changed months of the project (usually only the current
+    # month) and the index of all the projects
+    try:
+        lb = LogBook()
+        lb.do_publish_projects(PUBLISH_DIR, [sys.argv[1]])
+    except ProjectDoesNotExistError, ex:
+        print 'html-publish:', str(ex)
+        sys.exit(1)
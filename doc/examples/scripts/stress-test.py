@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2010 Arthur Furlan <afurlan@afurlan.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or any later version.
+#
+# On Debian systems, you can find the full text of the license in
+# /usr/share/common-licenses/GPL-2
+
+# Stress test of the logbook updates. Many concurrent writers (processes)
+# update the same project using the real update path (as "logbook -m" does),
+# optionally with slow hook scripts, then the logfile is parsed again to find
+# the lost and the duplicated tasks. The updates may also be sent to a
+# collector service running on the same process (as "logbook --remote" does).
+# Everything runs on a temporary home, so the user projects are never touched.
+
+import os
+import re
+import sys
+import time
+import shutil
+import threading
+import tempfile
+import optparse
+import multiprocessing
+
+# name of the project updated by the writers
+PROJECT = 'stress'
+
+# format of the messages sent by the writers
+MESSAGE = 'writer %d update %d'
+MESSAGE_RE = re.compile(r'writer (\d+) update (\d+)')
+
+
+# Send the updates of a writer, returning the duration of each update and
+# the updates which failed (and why)
+def run_writer(args):
+    writer, updates, address = args
+
+    import logbook
+    durations, failures = [], []
+    for i in range(updates):
+        lb = logbook.LogBook()
+        started = time.time()
+        try:
+            if address:
+                lb.do_remote_update(address, PROJECT, MESSAGE % (writer, i))
+            else:
+                lb.do_update_project(PROJECT, MESSAGE % (writer, i))
+        except Exception, ex:
+            failures.append(((writer, i), '%s: %s' % (type(ex).__name__, ex)))
+        finally:
+            lb._remove_temp_file()
+        durations.append(time.time() - started)
+    return durations, failures
+
+
+# Get a percentile of the sorted values
+def get_percentile(values, percent):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+# Create the project, with the slow hook scripts and the configuration
+def create_project(opts):
+    import logbook
+    lb = logbook.LogBook()
+    lb.do_create_project(PROJECT)
+
+    basedir = lb.get_project_basedir(PROJECT)
+    config = open(os.path.join(basedir, 'config'), 'a')
+    for option in ('journal', 'pipeline'):
+        if getattr(opts, option):
+            config.write('%s = True\n' % option)
+    config.close()
+
+    for hook in opts.hooks:
+        hooks_basedir = os.path.join(basedir, logbook.LOGBOOK_HOOKS[hook])
+        if not os.path.exists(hooks_basedir):
+            os.mkdir(hooks_basedir)
+        script_file_path = os.path.join(hooks_basedir, 'slow-hook.sh')
+        open(script_file_path, 'w').write('#!/bin/sh\nsleep %s\n' %
+            opts.hook_delay)
+        os.chmod(script_file_path, 0755)
+
+
+# Parse the logfile again, counting how many times each update was found
+def count_updates():
+    import logbook
+    lb = logbook.LogBook()
+    lb.do_compact_project(PROJECT)
+    lb._remove_temp_file()
+
+    editor = logbook.LogBookEditor(lb.config)
+    counts = {}
+    for entry in editor.iter_entries(editor.real_file_handler):
+        for tasks in entry['tasks'].values():
+            for task in tasks:
+                values = MESSAGE_RE.search(task)
+                if values:
+                    key = (int(values.group(1)), int(values.group(2)))
+                    counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+if __name__ == '__main__':
+
+    parser = optparse.OptionParser(usage='%prog [OPTIONS]')
+    parser.add_option('-w', '--writers', type='int', default=8,
+        help='number of concurrent writers (default: %default)')
+    parser.add_option('-u', '--updates', type='int', default=20,
+        help='number of updates of each writer (default: %default)')
+    parser.add_option('--hook', dest='hooks', action='append', default=[],
+        choices=['pre', 'saved', 'post'],
+        help='add a slow script to the hook (pre, saved or post)')
+    parser.add_option('--hook-delay', type='float', default=0.1,
+        help='duration of the slow hook scripts (default: %default)')
+    parser.add_option('--journal', action='store_true',
+        help='enable the journal of the project')
+    parser.add_option('--pipeline', action='store_true',
+        help='enable the pipelined update of the project')
+    parser.add_option('--collector', action='store_true',
+        help='send the updates to a collector service')
+    parser.add_option('--keep', action='store_true',
+        help='keep the temporary home with the project')
+    (opts, args) = parser.parse_args()
+
+    # the logbook directory depends on the home, so it's changed before the
+    # module is imported (also by the writers)
+    home = tempfile.mkdtemp(prefix='logbook-stress-')
+    os.environ['HOME'] = home
+    os.environ.setdefault('LOGNAME', 'stress')
+    if os.environ['LOGNAME'] == 'root':
+        os.environ['LOGNAME'] = 'stress'
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+        os.path.dirname(os.path.dirname(os.path.realpath(__file__))))), 'src'))
+
+    try:
+        create_project(opts)
+
+        # the collector only runs its server on a thread, its journals are
+        # compacted once all the writers are done
+        address = None
+        if opts.collector:
+            import logbook
+            address = os.path.join(home, 'collector.sock')
+            collector = logbook.LogBookCollector(address)
+            server = threading.Thread(target=collector.server.serve_forever)
+            server.daemon = True
+            server.start()
+
+        # run the writers at the same time, each one on its own process
+        pool = multiprocessing.Pool(opts.writers)
+        started = time.time()
+        results = pool.map(run_writer, [(w, opts.updates, address)
+            for w in range(opts.writers)])
+        elapsed = time.time() - started
+        pool.close()
+
+        if opts.collector:
+            collector.server.shutdown()
+            collector.compact()
+
+        # find the lost and the duplicated updates, the failed updates
+        # aren't expected to be found
+        durations = sorted(sum([r[0] for r in results], []))
+        failures = dict(sum([r[1] for r in results], []))
+        counts = count_updates()
+        expected = [(w, i) for w in range(opts.writers)
+            for i in range(opts.updates) if (w, i) not in failures]
+        lost = [k for k in expected if k not in counts]
+        duplicated = [k for k in expected if counts.get(k, 0) > 1]
+
+        print 'writers:     %d' % opts.writers
+        print 'updates:     %d' % len(durations)
+        print 'elapsed:     %.3fs' % elapsed
+        print 'throughput:  %.1f updates/s' % (len(durations) / elapsed)
+        for percent in (50, 95, 99):
+            print 'p%d latency: %.3fs' % (percent,
+                get_percentile(durations, percent))
+        print 'failed:      %d' % len(failures)
+        print 'lost:        %d' % len(lost)
+        print 'duplicated:  %d' % len(duplicated)
+        for (w, i), error in sorted(failures.items()):
+            print '  failed: %s (%s)' % (MESSAGE % (w, i), error)
+        for w, i in lost:
+            print '  lost: %s' % (MESSAGE % (w, i))
+        for w, i in duplicated:
+            print '  duplicated: %s (%d times)' % (MESSAGE % (w, i),
+                counts[(w, i)])
+
+    finally:
+        if opts.keep:
+            print 'home:        %s' % home
+        else:
+            shutil.rmtree(home)
+
+    sys.exit(1 if failures or lost or duplicated else 0)
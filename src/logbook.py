@@ -13,15 +13,31 @@
 
 import os
 import re
+import cgi
+import csv
 import sys
 import glob
+import gzip
+import json
+import stat
 import time
+import fcntl
 import shlex
 import shutil
 import socket
+import urllib
+import cPickle
 import getpass
+import hashlib
+import tempfile
 import optparse
+import StringIO
+import itertools
+import threading
 import subprocess
+import collections
+import SocketServer
+import multiprocessing
 
 
 # Directory which stores the user data
@@ -38,6 +54,92 @@ LOGBOOK_HOOKS = {
     'post': 'hooks.d-post',     # after the real logbook file is saved
 }
 
+# Name of the file, inside the project directory, which caches the parsed
+# current entry between the logbook executions
+LOGBOOK_CACHE = 'cache'
+
+# Suffix of the file, next to the logfile, which stores the hash chain of the
+# logbook entries (one line per entry, the oldest first), so all the writers of
+# a shared logfile update the same chain. And the name of the file, inside the
+# project directory, which stores the last position of the chain verified by
+# the user
+LOGBOOK_CHAIN = '.chain'
+LOGBOOK_CHAIN_CHECKPOINT = 'chain.verified'
+
+# Name of the file, inside the state directory of the user data directory,
+# which stores the list of the configured projects and their metadata. It's
+# rebuilt when the modify date of the user data directory changes, and the
+# metadata of a project is refreshed (by the commands which need it) when the
+# modify date of its configuration file changes
+LOGBOOK_REGISTRY = os.path.join('.state', 'registry')
+LOGBOOK_REGISTRY_FIELDS = ['project', 'label', 'logfile', 'basedir', 'updated',
+    'entries', 'mtime']
+
+# Name of the file, inside the publish directory, which stores the digest of
+# each published month of each project
+LOGBOOK_MANIFEST = '.manifest'
+
+# Template of the published HTML pages
+LOGBOOK_HTML = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>%(title)s</title>
+</head>
+<body>
+<h1>%(title)s</h1>
+%(body)s
+</body>
+</html>
+'''
+
+# Name of the file, inside the state directory of the user data directory,
+# which stores the values of the counters and histograms of the metrics, and
+# the metrics description. The file is replaced on each update, so it's kept
+# on its own directory to not change the modify date of the user data directory
+LOGBOOK_METRICS = os.path.join('.state', 'metrics')
+LOGBOOK_METRICS_HELP = {
+    'logbook_updates_total': ('counter', 'Number of project updates.'),
+    'logbook_update_duration_seconds': ('histogram',
+        'Duration of the project updates, without the text editor.'),
+    'logbook_hook_duration_seconds': ('histogram',
+        'Duration of the hook scripts.'),
+    'logbook_hook_failures_total': ('counter',
+        'Number of hook scripts which exited with error.'),
+    'logbook_logfile_size_bytes': ('gauge', 'Size of the logfile.'),
+    'logbook_entries': ('gauge', 'Number of entries of the logfile.'),
+    'logbook_current_entry_tasks': ('gauge',
+        'Number of tasks of the entry of the current day.'),
+    'logbook_last_update_timestamp_seconds': ('gauge',
+        'Modify date of the logfile.'),
+}
+
+# Suffix of the directory, next to the logfile, which stores the journals of
+# the updates not yet compacted into the logfile (one journal per writer)
+LOGBOOK_JOURNAL = '.journal'
+
+# Suffix of the file, next to the logfile, locked (exclusively) by the writers
+# while they read and commit the logfile, so the updates of concurrent writers
+# and the compacted journals aren't lost
+LOGBOOK_LOCK = '.lock'
+
+# Directory, inside the project base directory, which stores the attachments
+# of the tasks (compressed and named by the digest of their content)
+LOGBOOK_ATTACHMENTS = 'attachments'
+
+# Formats and fields of the exported records. The last exported version of
+# each project is stored in its "export.FORMAT" file (the watermark). The "id"
+# of a task (its project, version, author and position) doesn't change when
+# the task does, so a changed task can replace the record exported before
+LOGBOOK_EXPORT = 'export'
+LOGBOOK_EXPORT_FORMATS = ['json', 'csv']
+LOGBOOK_EXPORT_FIELDS = ['id', 'project', 'version', 'hostname', 'name',
+    'time', 'task']
+
+# Prefix of the files, inside the project base directory, which store the read
+# cursor of each user (the last read version and the digests of its tasks)
+LOGBOOK_CURSOR = 'cursor'
+
 
 # Exception thrown when a project currently exists. This exception is raised
 # if the user try to create a new project using a name that is already being
@@ -70,6 +172,36 @@ class UpdateAbortedError(Exception):
     pass
 
 
+# Exception thrown when a logbook file can't be parsed, like when an entry has
+# no footer or when the entries aren't sorted by version (newest first)
+class LogFileFormatError(Exception):
+    '''
+    Exception thrown when a logbook file can't be parsed, like when an entry has
+    no footer or when the entries aren't sorted by version (newest first).
+    '''
+    pass
+
+
+# Exception thrown when the hash chain verification of a project fails, what
+# means that some entry was changed after being committed
+class VerificationError(Exception):
+    '''
+    Exception thrown when the hash chain verification of a project fails, what
+    means that some entry was changed after being committed.
+    '''
+    pass
+
+
+# Exception thrown when the collector service can't be started or reached, or
+# rejects an update sent by the client
+class RemoteError(Exception):
+    '''
+    Exception thrown when the collector service can't be started or reached, or
+    rejects an update sent by the client.
+    '''
+    pass
+
+
 # Main application class
 class LogBook(object):
     '''
@@ -85,6 +217,7 @@ class LogBook(object):
 
         self.config = {}
         self.load_config()
+        self.metrics = LogBookMetrics()
 
 
     # Run the application via command line interface. Parse the arguments and
@@ -108,54 +241,107 @@ class LogBook(object):
         parser.add_option('-D', metavar='PROJECT',
             help='delete a logbook project')
         parser.add_option('-L', '--list', action='count',
-            help='list the configured projects')
+            help='list the configured projects (twice to show details)')
+        parser.add_option('--verify', action='store_true',
+            help='verify the hash chain of the projects')
+        parser.add_option('--publish', metavar='DIR',
+            help='publish the projects as HTML pages into a directory')
+        parser.add_option('--metrics', action='store_true',
+            help='display the metrics of the projects')
+        parser.add_option('--compact', action='store_true',
+            help='compact the journals into the logfile of a project')
+        parser.add_option('--serve', metavar='ADDRESS',
+            help='run the collector service (HOST:PORT or socket path)')
+        parser.add_option('--import', dest='import_file', metavar='FILE',
+            help='merge an external logbook file into a project')
+        parser.add_option('--export', metavar='FORMAT', type='choice',
+            choices=LOGBOOK_EXPORT_FORMATS,
+            help='export the new tasks of the projects (json or csv)')
+        parser.add_option('--unread', action='store_true',
+            help='display the tasks of the projects not read yet (the first '
+                'time, the current tasks are only marked as read)')
 
         # application options
         parser.add_option('-f', metavar='FILE',
             help='configure the project to use an external file')
         parser.add_option('-m', metavar='MESSAGE',
             help='set the update message')
+        parser.add_option('--attach', metavar='FILE', action='append',
+            help='attach a file to the update message')
+        parser.add_option('--expand', action='store_true',
+            help='view the attachments inside the logbook file')
+        parser.add_option('--remote', metavar='ADDRESS',
+            help='send the update message to a collector service')
         parser.add_option('-l', metavar='LABEL',
             help='project label to be used in the logbook file')
         parser.add_option('-b', metavar='BASEDIR',
             help='set the logbook base directory')
+        parser.add_option('-n', '--dry-run', action='store_true',
+            help='only report what would be changed')
+        parser.add_option('--full', action='store_true',
+            help='verify or publish all the entries, not only the new ones')
+        parser.add_option('--peek', action='store_true',
+            help='display the unread tasks without marking them as read '
+                '(implies --unread)')
         (opts, args) = parser.parse_args()
 
         if opts.list:   # list the configured projects
-            return self.do_list_projects()
+            return self.do_list_projects(opts.list > 1)
         elif opts.V:    # view a logbook project file
-            return self.do_view_project(opts.V)
+            return self.do_view_project(opts.V, opts.expand)
         elif opts.C:    # create a new logbook project
             return self.do_create_project(opts.C, opts.f, opts.l, opts.b)
         elif opts.D:    # delete a logbook project
             return self.do_delete_project(opts.D)
+        elif opts.verify:   # verify the hash chain of the projects
+            return self.do_verify_projects(args, opts.full)
+        elif opts.serve:    # run the collector service
+            return LogBookCollector(opts.serve).serve_forever()
+        elif opts.remote:   # send the update message to a collector service
+            if not opts.m:
+                parser.error('option --remote requires an update message.')
+            return self.do_remote_update(opts.remote,
+                self.get_default_project(args), opts.m)
+        elif opts.compact:  # compact the journals into the logfile
+            return self.do_compact_project(self.get_default_project(args))
+        elif opts.metrics:  # display the metrics of the projects
+            return self.do_display_metrics()
+        elif opts.publish:  # publish the projects as HTML pages
+            return self.do_publish_projects(opts.publish, args, opts.full)
+        elif opts.export:   # export the new tasks of the projects
+            return self.do_export_projects(opts.export, args)
+        elif opts.unread or opts.peek:  # display the tasks not read yet
+            return self.do_unread_projects(args, opts.peek)
+        elif opts.import_file:  # merge an external file into a project
+            return self.do_import_project(self.get_default_project(args),
+                opts.import_file, opts.dry_run)
         else:           # update a logbook project
-            if not opts.U and not args:
-                projects = self.get_configured_projects()
-                if 'default' in self.config:
-                    args.append(self.config['default'])
-                elif len(projects) == 1:
-                    args.append(projects[0])
-                else:
-                    raise ProjectDoesNotExistError(
-                        'default project could not be found.')
-            return self.do_update_project(opts.U or args[0], opts.m)
+            return self.do_update_project(opts.U or
+                self.get_default_project(args), opts.m, opts.attach)
 
     
-    # Print the list of configured projects
-    def do_list_projects(self):
+    # Print the list of configured projects, one per line (what is useful for
+    # shell completion) or, if "details" is set, with their metadata
+    def do_list_projects(self, details=False):
         '''
-        Print the list of configured projects.
+        Print the list of configured projects, one per line (what is useful for
+        shell completion) or, if "details" is set, with their metadata.
         '''
 
-        for project in self.get_configured_projects():
-            print project
+        for p in self.get_registry(refresh=details):
+            if details:
+                print '%-20s %-20s %-8s %7s  %s' % (p['project'], p['label'],
+                    p['updated'] or '-', p['entries'], p['logfile'])
+            else:
+                print p['project']
 
 
-    # View the file logbook file of a project
-    def do_view_project(self, project):
+    # View the file logbook file of a project, with the content of the
+    # attachments if "expand" is set
+    def do_view_project(self, project, expand=False):
         '''
-        View the file logbook file of a project.
+        View the file logbook file of a project, with the content of the
+        attachments if "expand" is set.
         '''
 
         # check if the project really exists
@@ -163,8 +349,18 @@ class LogBook(object):
             raise ProjectDoesNotExistError(
                 'project "%s" could not be found.' % project)
 
-        # display the logbook file using the user "pager"
+        # display the logbook file using the user "pager", merged with the
+        # updates of the journals if there is any
         self.load_config(project)
+        self.editor = LogBookEditor(self.config)
+        if expand:
+            self.editor.expand_attachments()
+            return subprocess.call([self.config['pager'],
+                self.editor.temp_file_name])
+        elif self.editor.journal_files:
+            self.editor.compact_journals()
+            return subprocess.call([self.config['pager'],
+                self.editor.temp_file_name])
         return subprocess.call([self.config['pager'],
             self.config['logfile']])
 
@@ -195,8 +391,13 @@ class LogBook(object):
             if not os.path.exists(hooks_basedir):
                 os.mkdir(hooks_basedir)
 
-        # create the project configuration file
+        # create the project configuration file and the hash chain of the
+        # logfile, unless it's shared and already has one
         self._create_config(project, logfile, label, basedir)
+        self.load_config(project)
+        if not os.path.exists(self.config['logfile'] + LOGBOOK_CHAIN):
+            LogBookEditor(self.config).create_chain()
+        self._update_registry(project)
 
 
     # Delete a logbook project
@@ -213,12 +414,15 @@ class LogBook(object):
         # remove the project base directory but don't touch in other files,
         # like external basedir or logfiles.
         shutil.rmtree(self.get_project_basedir(project))
+        self._update_registry(project)
 
 
-    # Update a logbook project
-    def do_update_project(self, project, message=None):
+    # Update a logbook project, attaching the "attachments" files to the new
+    # task
+    def do_update_project(self, project, message=None, attachments=None):
         '''
-        Update a logbook project.
+        Update a logbook project, attaching the "attachments" files to the new
+        task.
         '''
 
         # check if the project really exists
@@ -231,40 +435,520 @@ class LogBook(object):
 
         # load the project congif and execute the "pre" hook scripts
         self.load_config(project)
+        self.editor = None
+        started, status = time.time(), 'failed'
+        try:
+
+            # store the attachments and add their references to the message
+            references = [LogBookAttachments(self.config).store_file(f)
+                for f in attachments or []]
+            if message and references:
+                message = ' '.join([message.rstrip('\n')] + references)
+
+            # just append the message to the journal of the user, if enabled,
+            # it'll be compacted into the logfile later
+            if message and self.config.get('journal', False):
+                LogBookJournal(self.config).append(message)
+                status = 'ok'
+                return
+
+            if self.config.get('pipeline', False):
+                self._call_hooks_and_parse(LOGBOOK_HOOKS['pre'])
+            else:
+                self._call_hooks(LOGBOOK_HOOKS['pre'])
+                self.editor = LogBookEditor(self.config)
+                self.editor.parse()
+
+            # execute the user editor if there's no message sent via command
+            # line, the time spent on the editor isn't part of the update time.
+            # The pasted attachments are stored after the file is edited
+            if not message:
+                if references:
+                    self.editor.add_entry_message(' '.join(references),
+                        keep_open=True)
+                editing = time.time()
+                edited = self.editor.edit_file()
+                started += time.time() - editing
+                if not edited:
+                    raise UpdateAbortedError()
+                self.editor.store_attachments()
+            else:
+                self.editor.add_entry_message(message)
+
+            # commit the changes and executhe the respective hook scripts. The
+            # logfile is only locked now, so the other writers don't wait for
+            # the text editor
+            self._call_hooks(LOGBOOK_HOOKS['saved'], send_all_args=True)
+            self.editor.lock()
+            self.editor.commit_changes()
+            self._update_registry(project)
+            self._call_hooks(LOGBOOK_HOOKS['post'], send_all_args=True)
+            status = 'ok'
+
+        except UpdateAbortedError:
+            status = 'aborted'
+            raise
+
+        # unlock the logfile, if it wasn't committed, record the update metrics
+        # and write the metrics file
+        finally:
+            if self.editor:
+                self.editor.unlock()
+            self.metrics.inc('logbook_updates_total', project=project,
+                status=status)
+            self.metrics.observe('logbook_update_duration_seconds',
+                time.time() - started, project=project)
+            self._save_metrics()
+
+
+    # Send an update message to a collector service, which stores it on the
+    # project with the same name
+    def do_remote_update(self, address, project, message):
+        '''
+        Send an update message to a collector service, which stores it on the
+        project with the same name.
+        '''
+
+        self.load_config()
+        response = _call_collector(address, {
+            'action': 'task',
+            'project': project,
+            'name': self.config['name'],
+            'email': self.config['email'],
+            'hostname': socket.gethostname(),
+            'message': message,
+        })
+
+        if response.get('status') != 'ok':
+            raise RemoteError(response.get('error', 'unknown error.'))
+
+
+    # Compact the updates of the journals into the logfile of a project
+    def do_compact_project(self, project):
+        '''
+        Compact the updates of the journals into the logfile of a project.
+        '''
+
+        # check if the project really exists
+        if not self.project_exists(project):
+            raise ProjectDoesNotExistError(
+                'project "%s" could not be found.' % project)
+
+        # load the project config and execute the "pre" hook scripts
+        self.load_config(project)
         self._call_hooks(LOGBOOK_HOOKS['pre'])
 
-        # execute the user editor if there's no message sent via command line
-        self.editor = LogBookEditor(self.config)
-        self.editor.parse()
-        if not message:
-            if not self.editor.edit_file():
-                raise UpdateAbortedError()
-        else:
-            self.editor.add_entry_message(message)
+        # write the logfile merged with the journals, if there's any update.
+        # The logfile is locked from the journals are read until they're
+        # removed, so no update is lost or compacted twice
+        self.editor = LogBookEditor(self.config, lock=True)
+        try:
+            if not self.editor.journal_files:
+                return
+            self.editor.compact_journals()
+
+            # commit the changes and execute the respective hook scripts
+            self._call_hooks(LOGBOOK_HOOKS['saved'], send_all_args=True)
+            self.editor.commit_changes()
+        finally:
+            self.editor.unlock()
+        self._update_registry(project)
+        self._call_hooks(LOGBOOK_HOOKS['post'], send_all_args=True)
+
+
+    # Display the metrics of the projects in the Prometheus text format
+    def do_display_metrics(self):
+        '''
+        Display the metrics of the projects in the Prometheus text format.
+        '''
+
+        state = self.metrics.load(os.path.join(LOGBOOK_USERDIR,
+            LOGBOOK_METRICS))
+        sys.stdout.write(self.metrics.render(state, self.get_gauges()))
+
+
+    # Merge an external logbook file into a logbook project
+    def do_import_project(self, project, file_name, dry_run=False):
+        '''
+        Merge an external logbook file into a logbook project.
+        '''
+
+        # check if the project really exists
+        if not self.project_exists(project):
+            raise ProjectDoesNotExistError(
+                'project "%s" could not be found.' % project)
+        # ... and if the user running the application isn't the root
+        elif not self._check_user_root():
+            raise UpdateAbortedError()
+
+        # load the project config and execute the "pre" hook scripts
+        self.load_config(project)
+        self._call_hooks(LOGBOOK_HOOKS['pre'])
 
-        # commit the changes and executhe the respective hook scripts
-        self._call_hooks(LOGBOOK_HOOKS['saved'], send_all_args=True)
-        self.editor.commit_changes()
+        # merge the files and only display the report on a "dry run"
+        self.editor = LogBookEditor(self.config, lock=not dry_run)
+        try:
+            report = self.editor.merge_file(file_name, dry_run)
+            if dry_run:
+                for line in report:
+                    print line
+                return
+
+            # commit the changes and execute the respective hook scripts, the
+            # hash chain is updated from the oldest merged entry
+            self._call_hooks(LOGBOOK_HOOKS['saved'], send_all_args=True)
+            self.editor.commit_changes()
+        finally:
+            self.editor.unlock()
+        self._update_registry(project)
         self._call_hooks(LOGBOOK_HOOKS['post'], send_all_args=True)
 
 
+    # Export the tasks of the projects (or of all the configured projects) as
+    # records in the standard output. Only the tasks which weren't exported
+    # yet, in the same format, are written
+    def do_export_projects(self, format, projects=None):
+        '''
+        Export the tasks of the projects (or of all the configured projects) as
+        records in the standard output. Only the tasks which weren't exported
+        yet, in the same format, are written.
+        '''
+
+        # check if the projects really exist and load their watermarks
+        projects = projects or self.get_configured_projects()
+        watermarks = {}
+        for project in projects:
+            if not self.project_exists(project):
+                raise ProjectDoesNotExistError(
+                    'project "%s" could not be found.' % project)
+            watermarks[project] = self._load_export_watermark(project, format)
+
+        # get the function which writes a record in the requested format
+        if format == 'csv':
+            writer = csv.writer(sys.stdout)
+            if not any(watermarks.values()):
+                writer.writerow(LOGBOOK_EXPORT_FIELDS)
+            write = lambda r: writer.writerow(
+                [r[f] for f in LOGBOOK_EXPORT_FIELDS])
+        else:
+            write = lambda r: sys.stdout.write(json.dumps(
+                collections.OrderedDict([(f, r[f].decode('utf-8', 'replace'))
+                for f in LOGBOOK_EXPORT_FIELDS])) + '\n')
+
+        # export the new tasks of each project and update its watermark only
+        # after the records were written
+        for project in projects:
+            self.load_config(project)
+            editor = LogBookEditor(self.config)
+            watermark = editor.export_tasks(write, watermarks[project])
+            sys.stdout.flush()
+            if watermark:
+                self._save_export_watermark(project, format, watermark)
+
+
+    # Display the tasks of the projects (or of all the configured projects)
+    # which weren't read by the user yet, and mark them as read unless "peek"
+    # is set. Only the entries newer than the read cursor are parsed. Without
+    # a cursor, the cursor is started at the newest entry and nothing is
+    # displayed, so the whole history isn't dumped the first time
+    def do_unread_projects(self, projects=None, peek=False):
+        '''
+        Display the tasks of the projects (or of all the configured projects)
+        which weren't read by the user yet, and mark them as read unless "peek"
+        is set. Only the entries newer than the read cursor are parsed. Without
+        a cursor, the cursor is started at the newest entry and nothing is
+        displayed, so the whole history isn't dumped the first time.
+        '''
+
+        # check if the projects really exist
+        projects = projects or self.get_configured_projects()
+        for project in projects:
+            if not self.project_exists(project):
+                raise ProjectDoesNotExistError(
+                    'project "%s" could not be found.' % project)
+
+        for project in projects:
+            self.load_config(project)
+            cursor = self._load_cursor(project)
+
+            # the logfile isn't even opened if it has the same size and modify
+            # date as when it was read, and there are no journals to merge
+            stat = self._get_logfile_stat()
+            if cursor and stat and cursor[2:] == stat[1:] and not \
+                    glob.glob(LogBookJournal(self.config).journal_dir + '/*'):
+                continue
+
+            # display the unread tasks, grouped by entry and author. The first
+            # entry is the newest one, which is where the new cursor points
+            self.editor = LogBookEditor(self.config)
+            new_cursor = None
+            for entry, tasks in self.editor.iter_unread_entries(cursor):
+                if not new_cursor:
+                    new_cursor = entry['version'], [
+                        self.editor.get_task_digest(n, t)
+                        for n in entry['names_order'] for t in entry['tasks'][n]]
+                if not cursor:
+                    break
+                if not any(tasks.values()):
+                    continue
+                sys.stdout.write('%s (%s)\n\n' % (project, entry['version']))
+                for name in entry['names_order']:
+                    if tasks[name]:
+                        sys.stdout.write('  [ %s ]\n' % name)
+                        sys.stdout.write(''.join([t.rstrip('\n') + '\n'
+                            for t in tasks[name]]) + '\n')
+
+            if not peek and new_cursor and stat:
+                self._save_cursor(project, new_cursor + stat[1:])
+
+
+    # Publish the projects (or all the configured projects) as static HTML
+    # pages, one page per month and an index of all the projects. Only the
+    # months changed since the last publication are rendered, unless "full"
+    # is set
+    def do_publish_projects(self, publish_dir, projects=None, full=False):
+        '''
+        Publish the projects (or all the configured projects) as static HTML
+        pages, one page per month and an index of all the projects. Only the
+        months changed since the last publication are rendered, unless "full"
+        is set.
+        '''
+
+        # check if the projects really exist
+        projects = projects or self.get_configured_projects()
+        for project in projects:
+            if not self.project_exists(project):
+                raise ProjectDoesNotExistError(
+                    'project "%s" could not be found.' % project)
+
+        publisher = LogBookPublisher(publish_dir)
+        for project in projects:
+            self.load_config(project)
+            editor = LogBookEditor(self.config)
+
+            # get the digest of each month, based on the digests of its entries
+            months = {}
+            for version, digest in editor.get_entry_digests():
+                month = version[:6]
+                months[month] = hashlib.md5(months.get(month, '') +
+                    digest).hexdigest()
+
+            # render the changed months and remove the pages of the old ones
+            published = publisher.manifest.get(project, {})
+            changed = [m for m in months if full or published.get(m) !=
+                months[m]]
+            publisher.render_months(editor, changed)
+            for month in published:
+                if month not in months:
+                    publisher.remove_month(project, month)
+            publisher.manifest[project] = months
+
+        # render the index of all the projects
+        publisher.render_index(self.get_registry(refresh=True))
+        publisher.save_manifest()
+
+
+    # Verify the hash chain of the projects (or of all the configured
+    # projects). Only the entries added since the last verification are
+    # checked, unless "full" is set, and then the projects are verified in
+    # parallel
+    def do_verify_projects(self, projects=None, full=False):
+        '''
+        Verify the hash chain of the projects (or of all the configured
+        projects). Only the entries added since the last verification are
+        checked, unless "full" is set, and then the projects are verified in
+        parallel.
+        '''
+
+        # check if the projects really exist
+        projects = projects or self.get_configured_projects()
+        for project in projects:
+            if not self.project_exists(project):
+                raise ProjectDoesNotExistError(
+                    'project "%s" could not be found.' % project)
+
+        # verify the projects, in parallel on a full verification
+        args = [(p, full) for p in projects]
+        if full and len(projects) > 1:
+            pool = multiprocessing.Pool()
+            results = pool.map(_verify_project_chain, args)
+            pool.close()
+        else:
+            results = map(_verify_project_chain, args)
+
+        # display the results
+        failed = []
+        for project, problems, verified in results:
+            for problem in problems:
+                print '%s: %s' % (project, problem)
+            if problems:
+                failed.append(project)
+            else:
+                print '%s: %d entries verified.' % (project, verified)
+
+        if failed:
+            raise VerificationError('hash chain verification failed for: %s.'
+                % ', '.join(failed))
+
+
+    # Verify the hash chain of a project, starting from the last verified
+    # position of the chain, unless "full" is set. Return the list of problems
+    # found and the number of verified entries
+    def verify_project(self, project, full=False):
+        '''
+        Verify the hash chain of a project, starting from the last verified
+        position of the chain, unless "full" is set. Return the list of problems
+        found and the number of verified entries.
+        '''
+
+        self.load_config(project)
+        checkpoint_file_path = os.path.join(self.get_project_basedir(project),
+            LOGBOOK_CHAIN_CHECKPOINT)
+
+        # load the last verified position of the chain: the number of entries
+        # and the chain hash of the last one
+        checkpoint = None
+        if not full and os.path.exists(checkpoint_file_path):
+            checkpoint_handler = open(checkpoint_file_path)
+            count, chain = checkpoint_handler.read().split()
+            checkpoint_handler.close()
+            checkpoint = int(count), chain
+
+        # the projects created before the hash chain don't have one yet, it's
+        # started now (but a chain which was already verified was removed)
+        if not os.path.exists(self.config['logfile'] + LOGBOOK_CHAIN):
+            if os.path.exists(checkpoint_file_path):
+                return ['hash chain file was removed after the last '
+                    'verification (remove "%s" to start it again).' %
+                    checkpoint_file_path], 0
+            editor = LogBookEditor(self.config, lock=True)
+            try:
+                editor.start_chain()
+            finally:
+                editor.unlock()
+
+        # verify the chain and save the new verified position
+        editor = LogBookEditor(self.config)
+        problems, checkpoint, verified = editor.verify_chain(checkpoint)
+        if not problems and checkpoint:
+            checkpoint_handler = open(checkpoint_file_path + '.tmp', 'w')
+            checkpoint_handler.write('%d %s\n' % checkpoint)
+            checkpoint_handler.close()
+            os.rename(checkpoint_file_path + '.tmp', checkpoint_file_path)
+
+        return problems, verified
+
+
+    # Return the project passed in the command line arguments or, if there is
+    # no project in "args", the configured default project
+    def get_default_project(self, args):
+        '''
+        Return the project passed in the command line arguments or, if there is
+        no project in "args", the configured default project.
+        '''
+
+        if args:
+            return args[0]
+
+        projects = self.get_configured_projects()
+        if 'default' in self.config:
+            return self.config['default']
+        elif len(projects) == 1:
+            return projects[0]
+
+        raise ProjectDoesNotExistError(
+            'default project could not be found.')
+
+
     # Return a list containing all configured projects
     def get_configured_projects(self):
         '''
         Return a list containing all configured projects
         '''
 
-        projects = []
+        return [p['project'] for p in self.get_registry()]
+
+
+    # Return the registry of the configured projects, a list containing the
+    # metadata of each project. The registry file is rebuilt only if the user
+    # data directory was changed since it was saved and, if "refresh" is set,
+    # the metadata of the projects whose configuration file was changed is
+    # refreshed (the project names don't need it, like the shell completion)
+    def get_registry(self, refresh=False):
+        '''
+        Return the registry of the configured projects, a list containing the
+        metadata of each project. The registry file is rebuilt only if the user
+        data directory was changed since it was saved and, if "refresh" is set,
+        the metadata of the projects whose configuration file was changed is
+        refreshed (the project names don't need it, like the shell completion).
+        '''
+
+        registry = self._load_registry()
+        if registry is not None:
+            if not refresh:
+                return registry
+            changed = False
+            for i, p in enumerate(registry):
+                if p.get('mtime') != self._get_config_mtime(p['project']):
+                    registry[i] = self._get_project_metadata(p['project'])
+                    changed = True
+            if changed:
+                self._save_registry(registry)
+            return registry
 
         # Search for all projects into the user data directory
+        registry = []
         try:
-            for p in os.listdir(LOGBOOK_USERDIR):
-                if os.path.isdir(os.path.join(LOGBOOK_USERDIR, p)):
-                    projects.append(p)
+            for p in sorted(os.listdir(LOGBOOK_USERDIR)):
+                if not p.startswith('.') and \
+                        os.path.isdir(os.path.join(LOGBOOK_USERDIR, p)):
+                    registry.append(self._get_project_metadata(p))
         except OSError:
-            pass
+            return registry
+
+        self._save_registry(registry)
+        return registry
+
+
+    # Return the gauges of the projects, computed from the registry, the cache
+    # of the current entries and the logfile sizes (no logfile is parsed)
+    def get_gauges(self):
+        '''
+        Return the gauges of the projects, computed from the registry, the cache
+        of the current entries and the logfile sizes (no logfile is parsed).
+        '''
 
-        return projects
+        gauges = []
+        version = time.strftime('%Y%m%d')
+        for p in self.get_registry(refresh=True):
+            labels = {'project': p['project']}
+            gauges.append(('logbook_entries', labels, int(p['entries'])))
+
+            try:
+                stat = os.stat(p['logfile'])
+            except OSError:
+                continue
+            gauges.append(('logbook_logfile_size_bytes', labels,
+                stat.st_size))
+            gauges.append(('logbook_last_update_timestamp_seconds', labels,
+                stat.st_mtime))
+
+            # count the tasks of the cached current entry
+            tasks = 0
+            try:
+                cache_handler = open(os.path.join(
+                    self.get_project_basedir(p['project']), LOGBOOK_CACHE),
+                    'rb')
+                cached = cPickle.load(cache_handler)
+                cache_handler.close()
+                if cached['version'] == version:
+                    tasks = sum([len(t) for t in
+                        cached['entry']['tasks'].values()])
+            except (IOError, EOFError, cPickle.UnpicklingError):
+                pass
+            gauges.append(('logbook_current_entry_tasks', labels, tasks))
+
+        return gauges
 
 
     # Return the absolut base directory of a project
@@ -289,9 +973,17 @@ class LogBook(object):
             raise ProjectDoesNotExistError(
                 'project "%s" could not be found.' % project)
 
-        config_file_path = os.path.join(LOGBOOK_USERDIR, project, 'config')
-        if os.path.exists(config_file_path):
-            execfile(config_file_path, {}, self.config)
+        # always load the global configuration first, so the configuration of
+        # a previously loaded project is discarded
+        config_file_paths = [os.path.join(LOGBOOK_USERDIR, 'config')]
+        if project:
+            config_file_paths.append(os.path.join(LOGBOOK_USERDIR, project,
+                'config'))
+
+        self.config = {}
+        for config_file_path in config_file_paths:
+            if os.path.exists(config_file_path):
+                execfile(config_file_path, {}, self.config)
 
         # load the configuration from the environment vars (if needed) and force
         # some "non-optional" configuration values
@@ -311,6 +1003,225 @@ class LogBook(object):
         return os.path.exists(self.get_project_basedir(project))
 
 
+    # Load the registry file, returning None if it's outdated or invalid
+    def _load_registry(self):
+        '''
+        Load the registry file, returning None if it's outdated or invalid.
+        '''
+
+        try:
+            registry_handler = open(os.path.join(LOGBOOK_USERDIR,
+                LOGBOOK_REGISTRY))
+            mtime = os.stat(LOGBOOK_USERDIR).st_mtime
+        except (IOError, OSError):
+            return None
+
+        # the first line contains the modify date of the user data directory
+        # and the number of projects, the following lines contain the projects
+        try:
+            header = registry_handler.readline().split()
+            registry = [dict(zip(LOGBOOK_REGISTRY_FIELDS,
+                l.rstrip('\n').split('\t'))) for l in registry_handler]
+        finally:
+            registry_handler.close()
+
+        if header != [repr(mtime), str(len(registry))]:
+            return None
+        return registry
+
+
+    # Save the registry file. The file is replaced only when it's completely
+    # written, so the readers never see it partially written, and it's kept on
+    # the state directory, so the modify date of the user data directory is not
+    # changed
+    def _save_registry(self, registry):
+        '''
+        Save the registry file. The file is replaced only when it's completely
+        written, so the readers never see it partially written, and it's kept on
+        the state directory, so the modify date of the user data directory is not
+        changed.
+        '''
+
+        registry_file_path = os.path.join(LOGBOOK_USERDIR, LOGBOOK_REGISTRY)
+        state_dir = os.path.dirname(registry_file_path)
+        try:
+            if not os.path.isdir(state_dir):
+                os.mkdir(state_dir)
+        except OSError:
+            pass
+
+        try:
+            mtime = os.stat(LOGBOOK_USERDIR).st_mtime
+            fd, temp_file_path = tempfile.mkstemp(dir=state_dir)
+        except (IOError, OSError):
+            return
+
+        os.fchmod(fd, 0644)
+        registry_handler = os.fdopen(fd, 'w')
+        registry_handler.write('%r %d\n' % (mtime, len(registry)))
+        for p in registry:
+            registry_handler.write('\t'.join([str(p[f])
+                for f in LOGBOOK_REGISTRY_FIELDS]) + '\n')
+        registry_handler.close()
+        os.rename(temp_file_path, registry_file_path)
+
+
+    # Update the metadata of a project in the registry, removing the project
+    # if it doesn't exist anymore
+    def _update_registry(self, project):
+        '''
+        Update the metadata of a project in the registry, removing the project
+        if it doesn't exist anymore.
+        '''
+
+        registry = [p for p in self.get_registry() if p['project'] != project]
+        if self.project_exists(project):
+            registry.append(self._get_project_metadata(project))
+            registry.sort(key=lambda p: p['project'])
+        self._save_registry(registry)
+
+
+    # Get the metadata of a project, reading only its configuration file and
+    # the last line of its hash chain
+    def _get_project_metadata(self, project):
+        '''
+        Get the metadata of a project, reading only its configuration file and
+        the last line of its hash chain.
+        '''
+
+        project_basedir = self.get_project_basedir(project)
+        config = {'label': project, 'logfile': '', 'basedir': project_basedir}
+        config_file_path = os.path.join(project_basedir, 'config')
+        if os.path.exists(config_file_path):
+            execfile(config_file_path, {}, config)
+
+        # the hash chain has a line per entry, the last one is the newest
+        updated, entries = '', 0
+        try:
+            chain_handler = open(config['logfile'] + LOGBOOK_CHAIN)
+            entries = os.fstat(chain_handler.fileno()).st_size / \
+                LogBookEditor.chain_line_size
+            if entries:
+                chain_handler.seek((entries - 1) *
+                    LogBookEditor.chain_line_size)
+                updated = chain_handler.readline().split()[0]
+            chain_handler.close()
+        except (IOError, OSError):
+            pass
+
+        return {
+            'project': project,
+            'label': config['label'] or project,
+            'logfile': config['logfile'],
+            'basedir': config['basedir'] or project_basedir,
+            'updated': updated,
+            'entries': entries,
+            'mtime': self._get_config_mtime(project),
+        }
+
+
+    # Get the modify date of the configuration file of a project, as saved in
+    # the registry
+    def _get_config_mtime(self, project):
+        '''
+        Get the modify date of the configuration file of a project, as saved in
+        the registry.
+        '''
+
+        try:
+            return repr(os.stat(os.path.join(self.get_project_basedir(project),
+                'config')).st_mtime)
+        except OSError:
+            return ''
+
+
+    # Load the export watermark of a project, a tuple containing the last
+    # exported version and the digests of its exported tasks
+    def _load_export_watermark(self, project, format):
+        '''
+        Load the export watermark of a project, a tuple containing the last
+        exported version and the digests of its exported tasks.
+        '''
+
+        watermark_file_path = os.path.join(self.get_project_basedir(project),
+            '%s.%s' % (LOGBOOK_EXPORT, format))
+
+        try:
+            watermark_handler = open(watermark_file_path)
+        except IOError:
+            return None
+
+        # the first line contains the version and the number of tasks, the
+        # following lines contain the task digests
+        version, count = watermark_handler.readline().split()
+        digests = [d.strip() for d in watermark_handler]
+        watermark_handler.close()
+
+        return version, digests[:int(count)]
+
+
+    # Save the export watermark of a project
+    def _save_export_watermark(self, project, format, watermark):
+        '''
+        Save the export watermark of a project.
+        '''
+
+        watermark_file_path = os.path.join(self.get_project_basedir(project),
+            '%s.%s' % (LOGBOOK_EXPORT, format))
+
+        version, digests = watermark
+        watermark_handler = open(watermark_file_path + '.tmp', 'w')
+        watermark_handler.write('%s %d\n' % (version, len(digests)))
+        for digest in digests:
+            watermark_handler.write(digest + '\n')
+        watermark_handler.close()
+        os.rename(watermark_file_path + '.tmp', watermark_file_path)
+
+
+    # Load the read cursor of the user on a project, a tuple containing the
+    # last read version, the digests of its tasks and the size and modify date
+    # of the logfile when it was read
+    def _load_cursor(self, project):
+        '''
+        Load the read cursor of the user on a project, a tuple containing the
+        last read version, the digests of its tasks and the size and modify date
+        of the logfile when it was read.
+        '''
+
+        cursor_file_path = os.path.join(self.get_project_basedir(project),
+            '%s.%s' % (LOGBOOK_CURSOR, getpass.getuser()))
+
+        try:
+            cursor_handler = open(cursor_file_path)
+        except IOError:
+            return None
+
+        # the first line contains the version, the size and the modify date,
+        # the following lines contain the digests of the tasks
+        version, size, mtime = cursor_handler.readline().split()
+        digests = set([l.rstrip('\n') for l in cursor_handler])
+        cursor_handler.close()
+
+        return version, digests, int(size), float(mtime)
+
+
+    # Save the read cursor of the user on a project
+    def _save_cursor(self, project, cursor):
+        '''
+        Save the read cursor of the user on a project.
+        '''
+
+        cursor_file_path = os.path.join(self.get_project_basedir(project),
+            '%s.%s' % (LOGBOOK_CURSOR, getpass.getuser()))
+
+        version, digests, size, mtime = cursor
+        cursor_handler = open(cursor_file_path + '.tmp', 'w')
+        cursor_handler.write('%s %d %r\n' % (version, size, mtime))
+        cursor_handler.write(''.join([d + '\n' for d in digests]))
+        cursor_handler.close()
+        os.rename(cursor_file_path + '.tmp', cursor_file_path)
+
+
     # Remove the temporary file
     def _remove_temp_file(self):
         '''
@@ -319,7 +1230,7 @@ class LogBook(object):
 
         try:
             os.unlink(self.editor.temp_file_name)
-        except (AttributeError, IOError):
+        except (AttributeError, OSError):
             pass
 
 
@@ -458,7 +1369,99 @@ class LogBook(object):
                 if send_all_args:
                     cmd_args.append(self.editor.get_current_version())
                     cmd_args.append(self.editor.temp_file_name)
-                subprocess.call(cmd_args)
+
+                # execute the script and record its duration and failures
+                started = time.time()
+                returncode = subprocess.call(cmd_args)
+                labels = {'project': self.config['project'], 'hook': hook,
+                    'script': os.path.basename(s)}
+                self.metrics.observe('logbook_hook_duration_seconds',
+                    time.time() - started, **labels)
+                if returncode:
+                    self.metrics.inc('logbook_hook_failures_total', **labels)
+
+
+    # Execute the scripts of a hook while the logfile is parsed, what saves
+    # the parsing time when the scripts are slow (like network updates). If
+    # the scripts changed the logfile, it's parsed again
+    def _call_hooks_and_parse(self, hook):
+        '''
+        Execute the scripts of a hook while the logfile is parsed, what saves
+        the parsing time when the scripts are slow (like network updates). If
+        the scripts changed the logfile, it's parsed again.
+        '''
+
+        # execute the hook scripts in another thread, keeping their errors
+        errors = []
+        def call_hooks():
+            try:
+                self._call_hooks(hook)
+            except Exception:
+                errors.append(sys.exc_info())
+
+        logfile_stat = self._get_logfile_stat()
+        thread = threading.Thread(target=call_hooks)
+        thread.start()
+
+        # parse the logfile, which may be incomplete if a script is writing it
+        self.editor = None
+        try:
+            self.editor = LogBookEditor(self.config)
+            self.editor.parse()
+        except LogFileFormatError:
+            self.editor = None
+
+        # wait for the scripts and parse the logfile again if it was changed
+        thread.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        elif not self.editor or self._get_logfile_stat() != logfile_stat:
+            self.editor = LogBookEditor(self.config)
+            self.editor.parse()
+
+
+    # Get the inode, size and modify date of the logfile, used to check if it
+    # was changed
+    def _get_logfile_stat(self):
+        '''
+        Get the inode, size and modify date of the logfile, used to check if it
+        was changed.
+        '''
+
+        try:
+            stat = os.stat(self.config['logfile'])
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime
+
+
+    # Save the recorded metrics and, if the "metrics" option is configured,
+    # write all the metrics into the file, which is usually read by the
+    # textfile collector of the Prometheus node exporter
+    def _save_metrics(self):
+        '''
+        Save the recorded metrics and, if the "metrics" option is configured,
+        write all the metrics into the file, which is usually read by the
+        textfile collector of the Prometheus node exporter.
+        '''
+
+        # the metrics never make an update fail, the errors are only reported
+        try:
+            state = self.metrics.save(os.path.join(LOGBOOK_USERDIR,
+                LOGBOOK_METRICS))
+            if not self.config.get('metrics'):
+                return
+
+            # the file is replaced only when it's completely written, so the
+            # collector never reads an incomplete file
+            metrics_file_path = os.path.expanduser(self.config['metrics'])
+            metrics_handler = open(metrics_file_path + '.tmp', 'w')
+            metrics_handler.write(self.metrics.render(state,
+                self.get_gauges()))
+            metrics_handler.close()
+            os.rename(metrics_file_path + '.tmp', metrics_file_path)
+        except (IOError, OSError), ex:
+            sys.stderr.write('Warning: metrics could not be saved: %s\n' % ex)
 
 
 # Class responsible for editting the files and for text editor handling
@@ -473,21 +1476,101 @@ class LogBookEditor(object):
     entry_footer_re = re.compile('^ -- (.*) <([^>]+)>  (.*)$')
     entry_author_re = re.compile('^  \[ (.*) \]$')
     entry_task_re = re.compile('^  \* (.*)$')
+    task_time_re = re.compile('^([0-9]{2}:[0-9]{2})(-[0-9]{2}:[0-9]{2})? ?')
+    folded_task_re = re.compile('^  \* ([0-9]{2}:[0-9]{2})'
+        '(?:-[0-9]{2}:[0-9]{2})? (.*?)(?: \(x([0-9]+)\))?$', re.S)
 
+    # Size of each line of the hash chain file ("VERSION DIGEST CHAIN\n") and
+    # the chain hash used before the first entry
+    chain_line_size = 139
+    chain_genesis = '0' * 64
 
-    # Initial setup based on the "config"
-    def __init__(self, config):
+
+    # Initial setup based on the "config". If "lock" is set, the logfile is
+    # locked until the changes are committed (or the editor is unlocked),
+    # otherwise it's only locked by "lock" before committing the changes
+    def __init__(self, config, lock=False):
         '''
-        Initial setup based on the "config"
+        Initial setup based on the "config". If "lock" is set, the logfile is
+        locked until the changes are committed (or the editor is unlocked),
+        otherwise it's only locked by "lock" before committing the changes.
         '''
     
         self.content = ''
         self.config = config
+        self.current_entry = None
+        self.temp_file_name = '/tmp/logbook-%s-%d-%d' % \
+            (self.config['project'], int(time.time()), os.getpid())
+
+        # lock the logfile before reading it, waiting for the other writers
+        self.lock_handler = None
+        self.real_file_handler = None
+        if lock:
+            self.lock()
+        self._open_logfile()
+
+
+    # Lock the logfile, waiting for the other writers. If the logfile was
+    # changed since it was read (e.g. while the text editor was open), it's
+    # read again and the current entry of the temporary file is merged into
+    # it, so the updates of the other writers are kept
+    def lock(self):
+        '''
+        Lock the logfile, waiting for the other writers. If the logfile was
+        changed since it was read (e.g. while the text editor was open), it's
+        read again and the current entry of the temporary file is merged into
+        it, so the updates of the other writers are kept.
+        '''
+
+        if self.lock_handler:
+            return
+        self.lock_handler = open(self.config['logfile'] + LOGBOOK_LOCK, 'a')
+        fcntl.flock(self.lock_handler.fileno(), fcntl.LOCK_EX)
+        if not self.real_file_handler or \
+                self._get_logfile_stat() == self.logfile_stat:
+            return
+
+        temp_handler = open(self.temp_file_name)
+        entries = list(itertools.islice(self.iter_entries(temp_handler), 1))
+        temp_handler.close()
+
+        # the committed entry isn't the parsed one anymore, so it isn't cached
+        self.current_entry = None
+        self.real_file_handler.close()
+        self._open_logfile()
+        temp_handler = open(self.temp_file_name, 'w')
+        try:
+            self.merge_entries(iter(entries), temp_handler)
+        except LogFileFormatError:
+            self.unlock()
+            raise
+        finally:
+            temp_handler.close()
+
+
+    # Open the logfile to be read. If there are updates in the journals, the
+    # logfile is read merged with them, so the readers see all the updates
+    def _open_logfile(self):
+        '''
+        Open the logfile to be read. If there are updates in the journals, the
+        logfile is read merged with them, so the readers see all the updates.
+        '''
 
-        # start the file processing process
+        self.logfile_stat = self._get_logfile_stat()
         self.real_file_handler = open(self.config['logfile'])
-        self.temp_file_name = '/tmp/logbook-%s-%d' % \
-            (self.config['project'], int(time.time()))
+        self.journal = LogBookJournal(self.config)
+        self.journal_files, entries = self.journal.read()
+        self.merged_oldest = None
+        if self.journal_files:
+            merged_handler = tempfile.TemporaryFile()
+            try:
+                self.merge_entries(iter(entries), merged_handler,
+                    skip_duplicates=False)
+            except LogFileFormatError:
+                self.unlock()
+                raise
+            merged_handler.seek(0)
+            self.real_file_handler = merged_handler
 
 
     # Parse the current logfile in order to extract the current entry, if there
@@ -601,6 +1684,16 @@ class LogBookEditor(object):
         '''
 
         entry = self.get_empty_entry()
+
+        # use the cached current entry, if it's still valid
+        cached = self._load_cache()
+        if cached:
+            entry.update(cached['entry'])
+            entry['label'] = self.config.get('label', self.config['project'])
+            self.real_file_handler.seek(cached['offset'])
+            self.content = self.real_file_handler.read()
+            return entry
+
         line = self.real_file_handler.readline()
 
         # if the there is no lines (empty file)
@@ -622,46 +1715,94 @@ class LogBookEditor(object):
 
         # ... otherwise, parse this entry
         else:
-            entry['project'] = values[0]
-            entry['hostname'] = values[2]
-            entry['attrs'] = values[3:]
-
-            # parse all the entry tasks... the code below is complicated to
-            # explain and problably easier to understand by reading :)
-            tasks = []
-            values,name = None,None
-            while not values:
-                line = self.real_file_handler.readline()
-                values = self.entry_footer_re.search(line)
-
-                if values:
-                    values = values.groups()
-                    entry['name'] = values[0]
-                    entry['email'] = values[1]
-                    entry['datetime'] = values[2]
-                    name = name or entry['name']
-                    if tasks:
-                        self.add_entry_tasks(entry, name, tasks)
-                        
-                elif self.entry_author_re.match(line):
-                    if tasks:
-                        self.add_entry_tasks(entry, name, tasks)
-                    name = line.strip(' []\n')
-                    tasks = []
-
-                elif self.entry_task_re.match(line):
-                    tasks.append(line)
-
-                elif tasks and line:
-                    tasks[-1] += line
-           
-            # save the rest of the file content
+            self._parse_entry(entry, line, self.real_file_handler)
+
+            # save the rest of the file content and cache the parsed entry,
+            # unless it's merged with the journals
+            offset = self.real_file_handler.tell()
             self.content += ''.join(self.real_file_handler.readlines())
+            if not self.journal_files:
+                self.real_file_handler.seek(0)
+                self._save_cache(entry, self.real_file_handler.read(offset))
 
         # return the just parsed entry
         return entry
 
 
+    # Iterate over all the entries of a logbook file, one entry at a time, so
+    # even huge files can be processed using a bounded amount of memory. The
+    # yielded entries also carry their raw "text", exactly as read
+    @classmethod
+    def iter_entries(cls, handler):
+        '''
+        Iterate over all the entries of a logbook file, one entry at a time, so
+        even huge files can be processed using a bounded amount of memory. The
+        yielded entries also carry their raw "text", exactly as read.
+        '''
+
+        previous = None
+        for line in iter(handler.readline, ''):
+
+            # ignore the blank lines between the entries
+            if not line.strip():
+                continue
+
+            # anything else outside an entry must be an "entry header"
+            values = cls.entry_header_re.search(line)
+            if not values:
+                raise LogFileFormatError('invalid entry header in "%s": %s' %
+                    (handler.name, line.strip()))
+
+            # the entries must be sorted by version, the newest first
+            entry = {'label': values.group(1), 'version': values.group(2),
+                'tasks': {}, 'names_order': []}
+            if previous and entry['version'] > previous:
+                raise LogFileFormatError('entries of "%s" are not sorted, '
+                    'version %s found after %s.' % (handler.name,
+                    entry['version'], previous))
+            previous = entry['version']
+
+            entry['text'] = line + cls._parse_entry(entry, line, handler)
+            yield entry
+
+
+    # Iterate over the entries not read yet according to the read "cursor",
+    # yielding each entry and its unread tasks by author. The iteration stops
+    # on the first entry older than the cursor, so the rest of the file is
+    # never read. The tasks of the cursor entry are compared by digest, so the
+    # changed tasks (like the folded ones) are unread too
+    def iter_unread_entries(self, cursor=None):
+        '''
+        Iterate over the entries not read yet according to the read "cursor",
+        yielding each entry and its unread tasks by author. The iteration stops
+        on the first entry older than the cursor, so the rest of the file is
+        never read. The tasks of the cursor entry are compared by digest, so the
+        changed tasks (like the folded ones) are unread too.
+        '''
+
+        for entry in self.iter_entries(self.real_file_handler):
+            if cursor and entry['version'] < cursor[0]:
+                break
+
+            read = set()
+            if cursor and entry['version'] == cursor[0]:
+                read = cursor[1]
+            yield entry, dict([(n, [t for t in entry['tasks'][n]
+                if self.get_task_digest(n, t) not in read])
+                for n in entry['names_order']])
+
+
+    # Get the digest of a task of an author, used to know if the task was
+    # exported or read before
+    def get_task_digest(self, name, task):
+        '''
+        Get the digest of a task of an author, used to know if the task was
+        exported or read before.
+        '''
+
+        return hashlib.md5(name + '\n' + task.rstrip('\n')).hexdigest()
+
+
     # Get an empty entry using some default values based on the configuration
     def get_empty_entry(self):
         '''
@@ -706,29 +1847,40 @@ class LogBookEditor(object):
         return text
 
     
-    # Add a message to an entry directly and regenerate the temporary file
-    def add_entry_message(self, message):
+    # Add a message to an entry directly and regenerate the temporary file. If
+    # "keep_open" is set, the message is added at the end of the new task and
+    # the temporary file isn't regenerated, so the task can still be editted
+    def add_entry_message(self, message, keep_open=False):
         '''
-        Add a message to an entry directly and regenerate the temporary file.
+        Add a message to an entry directly and regenerate the temporary file. If
+        "keep_open" is set, the message is added at the end of the new task and
+        the temporary file isn't regenerated, so the task can still be editted.
         '''
 
         # append a '\n' to end of the message
         if not message.endswith('\n'):
             message += '\n'
 
-        # add the message as a new task in the last entry
-        name = self.config['name']
-        self.current_entry['tasks'][name][-1] = \
-            self.current_entry['tasks'][name][-1][:-1]
-        self.add_entry_tasks(self.current_entry, self.config['name'],
-            message,  move_last_breakline=True)
+        # add the message to the new task (the last one) of the user, keeping
+        # the entry exactly as it would be parsed from the file
+        tasks = self.current_entry['tasks'][self.config['name']]
+        if keep_open:
+            tasks[-1] = tasks[-1][:-2] + ' ' + message + '\n'
+            return
+
+        # if enabled, a message equal to the previous task of the user is
+        # folded into it ("HH:MM-HH:MM message (xN)") instead of added
+        if not (self.config.get('fold', False) and
+                self._fold_entry_message(tasks, message)):
+            tasks[-1] = tasks[-1][:-2] + message + '\n'
 
         # regenerate the temporary file
         self._create_temp_file()
 
 
     # Add a new tasks in an entry
-    def add_entry_tasks(self, entry, name, tasks, move_last_breakline=False):
+    @staticmethod
+    def add_entry_tasks(entry, name, tasks, move_last_breakline=False):
         '''
         Add a new tasks in an entry
         '''
@@ -755,26 +1907,327 @@ class LogBookEditor(object):
             entry['tasks'][name].append(tasks)
 
 
-    # Commit the changes made on the temporary file on the real file
-    def commit_changes(self):
+    # Merge an external logbook file (in Debian Changelog Syntax) into the
+    # logfile, writing the result on the temporary file. Both files are read
+    # one entry at a time and the entries of the same version are merged by
+    # author. Return a report of the merge, nothing is written if "dry_run"
+    def merge_file(self, file_name, dry_run=False):
         '''
-        Commit the changes made on the temporary file on the real file.
+        Merge an external logbook file (in Debian Changelog Syntax) into the
+        logfile, writing the result on the temporary file. Both files are read
+        one entry at a time and the entries of the same version are merged by
+        author. Return a report of the merge, nothing is written if "dry_run".
         '''
 
-        # open the files
-        temp_handler = open(self.temp_file_name)
-        file_handler = open(self.config['logfile'], 'w')
+        external_handler = open(file_name)
+        temp_handler = None
+        if not dry_run:
+            temp_handler = open(self.temp_file_name, 'w')
 
-        # read lines from the temporary file and write on the real
-        for line in temp_handler:
-            file_handler.write(line)
+        report = self.merge_entries(self.iter_entries(external_handler),
+            temp_handler)
 
         # close the files
-        temp_handler.close()
-        file_handler.close()
+        external_handler.close()
+        if temp_handler:
+            temp_handler.close()
 
+        return report
 
-    # Create the temporary file to be editted
+
+    # Merge the "external" entries (sorted by version, the newest first) into
+    # the entries of the logfile, writing the result on "output_handler" (if
+    # any). The entries of the same version are merged by author, skipping
+    # the duplicated tasks if "skip_duplicates" is set. The oldest changed
+    # version is kept on "merged_oldest". Return a report of the merge
+    def merge_entries(self, external_entries, output_handler=None,
+            skip_duplicates=True):
+        '''
+        Merge the "external" entries (sorted by version, the newest first) into
+        the entries of the logfile, writing the result on "output_handler" (if
+        any). The entries of the same version are merged by author, skipping
+        the duplicated tasks if "skip_duplicates" is set. The oldest changed
+        version is kept on "merged_oldest". Return a report of the merge.
+        '''
+
+        report = []
+        imported, merged = 0, 0
+
+        # get the first entry of each side, the local entries are parsed only
+        # while there are external entries left
+        local_entries = self.iter_entries(self.real_file_handler)
+        external = next(external_entries, None)
+        local = external and next(local_entries, None)
+
+        # write the newest entry of both sides until there are no external
+        # entries left
+        separator = ''
+        while external:
+            if not self.merged_oldest or \
+                    external['version'] < self.merged_oldest:
+                self.merged_oldest = external['version']
+            if local and local['version'] > external['version']:
+                text = local['text']
+                local = next(local_entries, None)
+            elif not local or external['version'] > local['version']:
+                text = self._import_entry(external, report)
+                external = next(external_entries, None)
+                imported += 1
+            else:
+                text = self._merge_entries(local, external, report,
+                    skip_duplicates)
+                external = next(external_entries, None)
+                local = external and next(local_entries, None)
+                merged += 1
+
+            if output_handler:
+                output_handler.write(separator + text)
+            separator = '\n'
+
+        # the rest of the logfile is copied as it is, without being parsed
+        if output_handler:
+            if local:
+                output_handler.write(separator + local['text'])
+            shutil.copyfileobj(self.real_file_handler, output_handler)
+
+        report.append('%d entries imported, %d entries merged.' %
+            (imported, merged))
+        return report
+
+
+    # Store the attachments pasted on the current entry of the temporary file,
+    # between a "<<<" line and a ">>>" line, replacing them by their
+    # references. Return the number of stored attachments
+    def store_attachments(self):
+        '''
+        Store the attachments pasted on the current entry of the temporary file,
+        between a "<<<" line and a ">>>" line, replacing them by their
+        references. Return the number of stored attachments.
+        '''
+
+        attachments = LogBookAttachments(self.config)
+        temp_handler = open(self.temp_file_name)
+        new_handler = open(self.temp_file_name + '.new', 'w')
+
+        # copy the file, storing the content between the markers
+        stored, pasted, indent = 0, None, ''
+        for line in iter(temp_handler.readline, ''):
+            if pasted is None and line.strip() == '<<<':
+                pasted, indent = [], line[:line.index('<')]
+            elif pasted is not None and line.strip() == '>>>':
+                new_handler.write('%s%s\n' % (indent,
+                    attachments.store(''.join(pasted), '%d lines' %
+                    len(pasted))))
+                pasted = None
+                stored += 1
+            elif pasted is not None:
+                pasted.append(line)
+            else:
+                new_handler.write(line)
+
+                # the rest of the file, after the current entry, is copied
+                if self.entry_footer_re.match(line):
+                    shutil.copyfileobj(temp_handler, new_handler)
+
+        # an unfinished attachment isn't an attachment
+        if pasted:
+            new_handler.write(indent + '<<<\n' + ''.join(pasted))
+
+        temp_handler.close()
+        new_handler.close()
+        os.rename(self.temp_file_name + '.new', self.temp_file_name)
+        return stored
+
+
+    # Write the logfile (merged with the updates of the journals) on the
+    # temporary file, with the content of each attachment after its
+    # reference. The attachments are read only when they're referenced
+    def expand_attachments(self):
+        '''
+        Write the logfile (merged with the updates of the journals) on the
+        temporary file, with the content of each attachment after its
+        reference. The attachments are read only when they're referenced.
+        '''
+
+        attachments = LogBookAttachments(self.config)
+        temp_handler = open(self.temp_file_name, 'w')
+        for line in self.real_file_handler:
+            temp_handler.write(line)
+            for digest in attachments.reference_re.findall(line):
+                for content in attachments.load(digest).splitlines():
+                    temp_handler.write('    | %s\n' % content)
+        temp_handler.close()
+
+
+    # Write the logfile, merged with the updates of the journals, on the
+    # temporary file. Return the number of updates in the journals
+    def compact_journals(self):
+        '''
+        Write the logfile, merged with the updates of the journals, on the
+        temporary file. Return the number of updates in the journals.
+        '''
+
+        temp_handler = open(self.temp_file_name, 'w')
+        shutil.copyfileobj(self.real_file_handler, temp_handler)
+        temp_handler.close()
+
+        return sum([len(r) for r in self.journal_files.values()])
+
+
+    # Commit the changes made on the temporary file on the real file. The hash
+    # chain is updated with the current entry and the merged entries
+    def commit_changes(self):
+        '''
+        Commit the changes made on the temporary file on the real file. The hash
+        chain is updated with the current entry and the merged entries.
+        '''
+
+        # open the files
+        temp_handler = open(self.temp_file_name)
+        file_handler = open(self.config['logfile'], 'w')
+
+        # read lines from the temporary file and write on the real
+        for line in temp_handler:
+            file_handler.write(line)
+
+        # close the files
+        temp_handler.close()
+        file_handler.close()
+
+        # cache the committed entry, it's validated against the real file
+        # before being used, so it's safe even if the user changed the entry
+        if self.current_entry:
+            self._save_cache(self.current_entry,
+                self.get_formatted_entry(self.current_entry))
+
+        # remove the updates of the journals, which are in the logfile now,
+        # and update the hash chain of the entries (the journals and the
+        # imported files may have changed old entries)
+        if self.journal_files:
+            self.journal.remove(self.journal_files)
+        self._update_chain(oldest=self.merged_oldest)
+        self.unlock()
+
+
+    # Get the inode, size and modify date of the logfile, used to check if it
+    # was changed
+    def _get_logfile_stat(self):
+        '''
+        Get the inode, size and modify date of the logfile, used to check if it
+        was changed.
+        '''
+
+        stat = os.stat(self.config['logfile'])
+        return stat.st_ino, stat.st_size, stat.st_mtime
+
+
+    # Unlock the logfile, if it was locked by the editor
+    def unlock(self):
+        '''
+        Unlock the logfile, if it was locked by the editor.
+        '''
+
+        if self.lock_handler:
+            self.lock_handler.close()
+            self.lock_handler = None
+
+
+    # Verify the hash chain of the entries, starting from the "checkpoint"
+    # returned by a previous verification or from the first entry. Return the
+    # list of problems found, the new checkpoint and the number of verified
+    # entries
+    def verify_chain(self, checkpoint=None):
+        '''
+        Verify the hash chain of the entries, starting from the "checkpoint"
+        returned by a previous verification or from the first entry. Return the
+        list of problems found, the new checkpoint and the number of verified
+        entries.
+        '''
+
+        try:
+            chain_handler = open(self._get_chain_file_path())
+        except IOError:
+            return ['hash chain file could not be found.'], checkpoint, 0
+
+        # get the number of entries in the chain and check if the chain didn't
+        # change before the checkpoint
+        count, chain = checkpoint or (0, self.chain_genesis)
+        total = os.fstat(chain_handler.fileno()).st_size / self.chain_line_size
+        if count > total:
+            chain_handler.close()
+            return ['hash chain was truncated.'], checkpoint, 0
+        elif count and self._read_chain_line(chain_handler, count - 1)[2] != \
+                chain:
+            chain_handler.close()
+            return ['hash chain was changed before the last verification.'], \
+                checkpoint, 0
+
+        # get the digests of the entries added after the checkpoint, which are
+        # the first ones in the file, and check them from the oldest one
+        problems = []
+        file_handler = open(self.config['logfile'])
+        entries = self.iter_entries(file_handler)
+        digests = [(e['version'], hashlib.sha256(e['text']).hexdigest())
+            for e in itertools.islice(entries, total - count)]
+        digests.reverse()
+        if len(digests) < total - count:
+            problems.append('%d entries are missing.' %
+                (total - count - len(digests)))
+        elif not count and next(entries, None):
+            problems.append('the oldest entries are not in the hash chain.')
+
+        chain_handler.seek(count * self.chain_line_size)
+        for version, digest in digests:
+            line = chain_handler.read(self.chain_line_size).split()
+            if line[:2] != [version, digest]:
+                problems.append('entry %s was changed.' % version)
+            elif hashlib.sha256(chain + version + digest).hexdigest() != \
+                    line[2]:
+                problems.append('hash chain is broken on entry %s.' % version)
+            chain = line[2]
+
+        # the new checkpoint is the last entry which can't be changed anymore,
+        # the current entry is still open for updates
+        if total and self._read_chain_line(chain_handler, total - 1)[0] == \
+                self.get_current_version():
+            total -= 1
+        if total:
+            checkpoint = total, self._read_chain_line(chain_handler,
+                total - 1)[2]
+
+        chain_handler.close()
+        file_handler.close()
+        return problems, checkpoint, len(digests)
+
+
+    # Fold a message into the previous task of the user, if it's the same
+    # message, removing the new task. Only the previous task is checked, so
+    # the cost doesn't depend on the size of the entry. Return True if the
+    # message was folded
+    def _fold_entry_message(self, tasks, message):
+        '''
+        Fold a message into the previous task of the user, if it's the same
+        message, removing the new task. Only the previous task is checked, so
+        the cost doesn't depend on the size of the entry. Return True if the
+        message was folded.
+        '''
+
+        if len(tasks) < 2:
+            return False
+        values = self.folded_task_re.match(tasks[-2].rstrip('\n'))
+        if not values or values.group(2) != message.rstrip('\n'):
+            return False
+
+        # the folded task keeps the time of the first message and gets the
+        # time of the new one and the count, and the last breakline
+        started, message, count = values.groups()
+        tasks[-2] = '  * %s-%s %s (x%d)\n\n' % (started, tasks[-1][4:9],
+            message, int(count or 1) + 1)
+        del tasks[-1]
+        return True
+
+
+    # Create the temporary file to be editted
     def _create_temp_file(self):
         '''
         Create the temporary file to be editted.
@@ -787,6 +2240,446 @@ class LogBookEditor(object):
         file_handler.close()
 
 
+    # Export the tasks of the logfile, calling "write" with the record of each
+    # task. The file is read until the version of the "watermark" (returned by
+    # a previous export) and the tasks already exported are skipped. Return
+    # the new watermark
+    def export_tasks(self, write, watermark=None):
+        '''
+        Export the tasks of the logfile, calling "write" with the record of each
+        task. The file is read until the version of the "watermark" (returned by
+        a previous export) and the tasks already exported are skipped. Return
+        the new watermark.
+        '''
+
+        version, digests = watermark or (None, [])
+        digests = set(digests)
+        new_watermark = None
+
+        for entry in self.iter_entries(self.real_file_handler):
+            if version and entry['version'] < version:
+                break
+
+            # write the tasks which were added or changed since the last export
+            exported = []
+            for name in entry['names_order']:
+                for position, task in enumerate(entry['tasks'][name]):
+                    task = task.rstrip('\n')
+                    digest = self.get_task_digest(name, task)
+                    exported.append(digest)
+                    if entry['version'] != version or digest not in digests:
+                        write(self._get_task_record(entry, name, task,
+                            position))
+
+            # the newest entry is the new watermark
+            if not new_watermark:
+                new_watermark = entry['version'], exported
+
+        return new_watermark or watermark
+
+
+    # Get the record of an entry task, the task at "position" among the tasks
+    # of the author, used to export it
+    def _get_task_record(self, entry, name, task, position):
+        '''
+        Get the record of an entry task, the task at "position" among the tasks
+        of the author, used to export it.
+        '''
+
+        # remove the "  * " prefix and the indentation of the task lines
+        text = '\n'.join([l.strip() for l in task[4:].splitlines()])
+        values = self.task_time_re.match(text)
+
+        return {
+            'id': '%s/%s/%s/%d' % (self.config['project'], entry['version'],
+                name, position + 1),
+            'project': self.config['project'],
+            'version': entry['version'],
+            'hostname': entry['hostname'],
+            'name': name,
+            'time': values and values.group(1) or '',
+            'task': text[values and values.end() or 0:],
+        }
+
+
+    # Get the version and the digest of each entry, the oldest first. The
+    # digests are read from the hash chain if it's up to date with the first
+    # entry of the logfile, otherwise they are computed from the logfile
+    def get_entry_digests(self):
+        '''
+        Get the version and the digest of each entry, the oldest first. The
+        digests are read from the hash chain if it's up to date with the first
+        entry of the logfile, otherwise they are computed from the logfile.
+        '''
+
+        entries = self.iter_entries(self.real_file_handler)
+        entry = next(entries, None)
+
+        # read the digests from the hash chain
+        digests = []
+        try:
+            chain_handler = open(self._get_chain_file_path())
+            digests = [tuple(l.split()[:2]) for l in chain_handler]
+            chain_handler.close()
+        except IOError:
+            pass
+
+        # compute the digests if the hash chain is outdated
+        if (entry and (not digests or digests[-1] != (entry['version'],
+                hashlib.sha256(entry['text']).hexdigest()))) or \
+                (digests and not entry):
+            digests = []
+            while entry:
+                digests.append((entry['version'],
+                    hashlib.sha256(entry['text']).hexdigest()))
+                entry = next(entries, None)
+            digests.reverse()
+
+        self.real_file_handler.seek(0)
+        return digests
+
+
+    # Get the text of an "external" entry which has no local entry of the same
+    # version. The label of the project is used, as on the merged entries, and
+    # the differences of the header are appended to the "report"
+    def _import_entry(self, external, report):
+        '''
+        Get the text of an "external" entry which has no local entry of the same
+        version. The label of the project is used, as on the merged entries, and
+        the differences of the header are appended to the "report".
+        '''
+
+        text = external.get('text') or self.get_formatted_entry(external)
+        label = self.config.get('label', self.config['project'])
+        if external['label'] != label:
+            report.append('%s: conflict on label, using "%s" instead of "%s".'
+                % (external['version'], label, external['label']))
+            text = label + text[len(external['label']):]
+        if external['hostname'] != socket.gethostname():
+            report.append('%s: imported from hostname "%s".' %
+                (external['version'], external['hostname']))
+        return text
+
+
+    # Merge the tasks of an "external" entry into a "local" entry of the same
+    # version, grouping them by author and skipping the duplicated tasks (if
+    # "skip_duplicates" is set). The conflicts found are appended to the
+    # "report". Return the merged text
+    def _merge_entries(self, local, external, report, skip_duplicates=True):
+        '''
+        Merge the tasks of an "external" entry into a "local" entry of the same
+        version, grouping them by author and skipping the duplicated tasks (if
+        "skip_duplicates" is set). The conflicts found are appended to the
+        "report". Return the merged text.
+        '''
+
+        # the local entry header is always kept
+        for key in ('label', 'hostname'):
+            if local[key] != external[key]:
+                report.append('%s: conflict on %s, keeping "%s" instead of '
+                    '"%s".' % (local['version'], key, local[key], external[key]))
+
+        # add the tasks of each author which aren't on the local entry yet
+        added, skipped = 0, 0
+        for name in external['names_order']:
+            known = []
+            if skip_duplicates:
+                known = [t.rstrip('\n') for t in local['tasks'].get(name, [])]
+            tasks = [t.rstrip('\n') + '\n' for t in external['tasks'][name]
+                if t.rstrip('\n') not in known]
+            # count the tasks before adding them, since the last breakline is
+            # added to the list as well
+            skipped += len(external['tasks'][name]) - len(tasks)
+            added += len(tasks)
+            if tasks:
+                self.add_entry_tasks(local, name, tasks,
+                    move_last_breakline=True)
+
+        report.append('%s: %d task(s) merged, %d duplicated task(s) skipped.' %
+            (local['version'], added, skipped))
+        return self.get_formatted_entry(local)
+
+
+    # Parse an entry, whose "header" line was already read, reading the lines
+    # of "handler" until the entry footer. Return the text of the parsed lines
+    @classmethod
+    def _parse_entry(cls, entry, header, handler):
+        '''
+        Parse an entry, whose "header" line was already read, reading the lines
+        of "handler" until the entry footer. Return the text of the parsed lines.
+        '''
+
+        values = cls.entry_header_re.search(header).groups()
+        entry['project'] = values[0]
+        entry['hostname'] = values[2]
+        entry['attrs'] = header.split(';', 1)[1].split()
+
+        # parse all the entry tasks... the code below is complicated to
+        # explain and problably easier to understand by reading :)
+        text = []
+        tasks = []
+        values,name = None,None
+        while not values:
+            line = handler.readline()
+            if not line:
+                raise LogFileFormatError('entry %s of "%s" has no footer.' %
+                    (entry['version'], handler.name))
+            text.append(line)
+            values = cls.entry_footer_re.search(line)
+
+            if values:
+                values = values.groups()
+                entry['name'] = values[0]
+                entry['email'] = values[1]
+                entry['datetime'] = values[2]
+                name = name or entry['name']
+                if tasks:
+                    cls.add_entry_tasks(entry, name, tasks)
+
+            elif cls.entry_author_re.match(line):
+                if tasks:
+                    cls.add_entry_tasks(entry, name, tasks)
+                name = line.strip(' []\n')
+                tasks = []
+
+            elif cls.entry_task_re.match(line):
+                tasks.append(line)
+
+            elif tasks and line:
+                tasks[-1] += line
+
+        return ''.join(text)
+
+
+    # Get the path of the file which stores the hash chain of the entries
+    def _get_chain_file_path(self):
+        '''
+        Get the path of the file which stores the hash chain of the entries.
+        '''
+
+        return self.config['logfile'] + LOGBOOK_CHAIN
+
+
+    # Read a line of the hash chain file, returning its version, entry digest
+    # and chain hash
+    def _read_chain_line(self, chain_handler, index):
+        '''
+        Read a line of the hash chain file, returning its version, entry digest
+        and chain hash.
+        '''
+
+        chain_handler.seek(index * self.chain_line_size)
+        return chain_handler.read(self.chain_line_size).split()
+
+
+    # Create the hash chain of all the entries of the logfile, replacing the
+    # current chain if there's one
+    def create_chain(self):
+        '''
+        Create the hash chain of all the entries of the logfile, replacing the
+        current chain if there's one.
+        '''
+
+        self._update_chain(rebuild=True)
+
+
+    # Start the hash chain of all the entries of the logfile, for the projects
+    # created before the hash chain
+    def start_chain(self):
+        '''
+        Start the hash chain of all the entries of the logfile, for the projects
+        created before the hash chain.
+        '''
+
+        sys.stderr.write('Notice: starting the hash chain of "%s".\n' %
+            self.config['project'])
+        self._update_chain(rebuild=True)
+
+
+    # Update the hash chain with the newest entries of the logfile. Only the
+    # line of the current entry (still open for updates) and the lines of the
+    # entries not older than "oldest" (the oldest entry changed by a merge)
+    # are replaced, the new lines are appended after the last kept line, which
+    # must still match the logfile. A mismatch is reported, so the changes can
+    # still be verified. A missing chain is started from all the entries,
+    # unless it was already verified by the user, and "rebuild" replaces it
+    def _update_chain(self, rebuild=False, oldest=None):
+        '''
+        Update the hash chain with the newest entries of the logfile. Only the
+        line of the current entry (still open for updates) and the lines of the
+        entries not older than "oldest" (the oldest entry changed by a merge)
+        are replaced, the new lines are appended after the last kept line, which
+        must still match the logfile. A mismatch is reported, so the changes can
+        still be verified. A missing chain is started from all the entries,
+        unless it was already verified by the user, and "rebuild" replaces it.
+        '''
+
+        project = self.config['project']
+        chain_file_path = self._get_chain_file_path()
+
+        # the projects created before the hash chain don't have one yet, but a
+        # chain which was already verified was removed
+        if not rebuild and not os.path.exists(chain_file_path):
+            if os.path.exists(os.path.join(LOGBOOK_USERDIR, project,
+                    LOGBOOK_CHAIN_CHECKPOINT)):
+                sys.stderr.write('Warning: hash chain of "%s" was removed '
+                    'after its last verification, it was not updated.\n' %
+                    project)
+                return
+            return self.start_chain()
+
+        # find the last line to be kept, the lines after it are replaced
+        index, kept = 0, None
+        if rebuild:
+            chain_handler = open(chain_file_path + '.tmp', 'w')
+        else:
+            chain_handler = open(chain_file_path, 'r+')
+            index = os.fstat(chain_handler.fileno()).st_size / \
+                self.chain_line_size
+            first = self.get_current_version()
+            if oldest and oldest < first:
+                first = oldest
+            while index:
+                kept = self._read_chain_line(chain_handler, index - 1)
+                if kept[0] < first:
+                    break
+                index, kept = index - 1, None
+
+        # get the digests of the entries newer than the kept line, the oldest
+        # first (all the entries if there's no kept line), checking the entry
+        # of the kept line. The older entries aren't even parsed
+        digests, matched = [], True
+        file_handler = open(self.config['logfile'])
+        try:
+            for entry in self.iter_entries(file_handler):
+                digest = hashlib.sha256(entry['text']).hexdigest()
+                if kept and entry['version'] <= kept[0]:
+                    matched = [entry['version'], digest] == kept[:2]
+                    break
+                digests.append((entry['version'], digest))
+            else:
+                matched = not kept
+        except LogFileFormatError, ex:
+            chain_handler.close()
+            sys.stderr.write('Warning: hash chain of "%s" was not updated: '
+                '%s\n' % (project, ex))
+            return
+        finally:
+            file_handler.close()
+        digests.reverse()
+
+        if not matched:
+            sys.stderr.write('Warning: entry %s of "%s" doesn\'t match its '
+                'hash chain line.\n' % (kept[0], project))
+
+        # append the lines of the newer entries after the kept line
+        chain = kept and kept[2] or self.chain_genesis
+        chain_handler.seek(index * self.chain_line_size)
+        for version, digest in digests:
+            line = self._get_chain_line(chain, version, digest)
+            chain_handler.write(line)
+            chain = line.split()[2]
+        chain_handler.truncate()
+        chain_handler.close()
+
+        if rebuild:
+            os.rename(chain_file_path + '.tmp', chain_file_path)
+
+
+    # Get a line of the hash chain file, chaining the digest of an entry to
+    # the chain hash of the previous entry
+    def _get_chain_line(self, chain, version, digest):
+        '''
+        Get a line of the hash chain file, chaining the digest of an entry to
+        the chain hash of the previous entry.
+        '''
+
+        chain = hashlib.sha256(chain + version + digest).hexdigest()
+        return '%s %s %s\n' % (version, digest, chain)
+
+
+    # Get the path of the file which caches the parsed current entry
+    def _get_cache_file_path(self):
+        '''
+        Get the path of the file which caches the parsed current entry.
+        '''
+
+        return os.path.join(LOGBOOK_USERDIR, self.config['project'],
+            LOGBOOK_CACHE)
+
+
+    # Load the cached current entry. The cache is only used if the logfile
+    # wasn't changed since the cache was saved (same size and modify date) and
+    # if the entry region of the file still matches the cached entry digest
+    def _load_cache(self):
+        '''
+        Load the cached current entry. The cache is only used if the logfile
+        wasn't changed since the cache was saved (same size and modify date) and
+        if the entry region of the file still matches the cached entry digest.
+        '''
+
+        if not self.config.get('cache', True) or self.journal_files:
+            return None
+
+        try:
+            cache_handler = open(self._get_cache_file_path(), 'rb')
+            try:
+                cached = cPickle.load(cache_handler)
+            finally:
+                cache_handler.close()
+            stat = os.fstat(self.real_file_handler.fileno())
+        except (IOError, OSError, EOFError, cPickle.UnpicklingError):
+            return None
+
+        # check the logfile, the version and the size and modify date
+        if cached.get('logfile') != self.config['logfile'] or \
+                cached.get('version') != self.get_current_version() or \
+                cached.get('size') != stat.st_size or \
+                cached.get('mtime') != stat.st_mtime:
+            return None
+
+        # check the digest of the entry region of the file
+        text = self.real_file_handler.read(cached['offset'])
+        self.real_file_handler.seek(0)
+        if hashlib.md5(text).hexdigest() != cached['digest']:
+            return None
+
+        return cached
+
+
+    # Save the parsed current entry on cache. The "text" argument must be the
+    # entry region of the file, exactly as it was written (or read)
+    def _save_cache(self, entry, text):
+        '''
+        Save the parsed current entry on cache. The "text" argument must be the
+        entry region of the file, exactly as it was written (or read).
+        '''
+
+        if not self.config.get('cache', True):
+            return
+
+        try:
+            stat = os.stat(self.config['logfile'])
+            cached = {
+                'logfile': self.config['logfile'],
+                'version': entry['version'],
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'offset': len(text),
+                'digest': hashlib.md5(text).hexdigest(),
+                'entry': entry,
+            }
+
+            # write the cache in a temporary file and then replace the old one
+            cache_file_path = self._get_cache_file_path()
+            cache_handler = open(cache_file_path + '.tmp', 'wb')
+            cPickle.dump(cached, cache_handler, cPickle.HIGHEST_PROTOCOL)
+            cache_handler.close()
+            os.rename(cache_file_path + '.tmp', cache_file_path)
+        except (IOError, OSError):
+            pass
+
+
     # Find the real path of the editor program
     def _resolve_editor_path(self, editor):
         '''
@@ -800,3 +2693,952 @@ class LogBookEditor(object):
                 return os.path.realpath(editor_path)
 
         return editor
+
+
+# Class responsible for rendering the logbook files as static HTML pages
+class LogBookPublisher(object):
+    '''
+    Class responsible for rendering the logbook files as static HTML pages.
+    '''
+
+
+    # Initial setup based on the publish directory
+    def __init__(self, publish_dir):
+        '''
+        Initial setup based on the publish directory.
+        '''
+
+        self.publish_dir = os.path.realpath(publish_dir)
+        if not os.path.exists(self.publish_dir):
+            os.makedirs(self.publish_dir)
+
+        # load the digest of each published month of each project
+        self.manifest = {}
+        manifest_file_path = os.path.join(self.publish_dir, LOGBOOK_MANIFEST)
+        if os.path.exists(manifest_file_path):
+            for line in open(manifest_file_path):
+                project, month, digest = line.split()
+                self.manifest.setdefault(project, {})[month] = digest
+
+
+    # Render the pages of the "months" of the project loaded on "editor". The
+    # entries are read until the oldest month to be rendered
+    def render_months(self, editor, months):
+        '''
+        Render the pages of the "months" of the project loaded on "editor". The
+        entries are read until the oldest month to be rendered.
+        '''
+
+        if not months:
+            return
+
+        # group the entries by month, rendering each month when it's complete
+        oldest = min(months)
+        month, entries = None, []
+        for entry in editor.iter_entries(editor.real_file_handler):
+            if entry['version'][:6] < oldest:
+                break
+            elif entry['version'][:6] != month:
+                if month in months:
+                    self._render_month(editor, month, entries)
+                month, entries = entry['version'][:6], []
+            entries.append(entry)
+
+        if month in months:
+            self._render_month(editor, month, entries)
+
+
+    # Remove the page of a month which has no entries anymore
+    def remove_month(self, project, month):
+        '''
+        Remove the page of a month which has no entries anymore.
+        '''
+
+        page_file_path = os.path.join(self.publish_dir, project,
+            self._get_month_page(month))
+        for file_path in (page_file_path, page_file_path + '.gz'):
+            if os.path.exists(file_path):
+                os.unlink(file_path)
+
+
+    # Render the index page, listing the published months of the projects of
+    # the "registry"
+    def render_index(self, registry):
+        '''
+        Render the index page, listing the published months of the projects of
+        the "registry".
+        '''
+
+        body = ['<ul>']
+        for p in registry:
+            if not self.manifest.get(p['project']):
+                continue
+
+            body.append('<li>%s (updated %s, %s entries)<br>' % (
+                cgi.escape(p['label']), p['updated'] or '-', p['entries']))
+            for month in sorted(self.manifest[p['project']], reverse=True):
+                body.append('<a href="%s/%s">%s-%s</a>' % (
+                    urllib.quote(p['project']), self._get_month_page(month),
+                    month[:4], month[4:]))
+            body.append('</li>')
+        body.append('</ul>')
+
+        self._write_page('index.html', 'logbook', '\n'.join(body))
+
+
+    # Save the digest of each published month of each project
+    def save_manifest(self):
+        '''
+        Save the digest of each published month of each project.
+        '''
+
+        manifest_file_path = os.path.join(self.publish_dir, LOGBOOK_MANIFEST)
+        manifest_handler = open(manifest_file_path + '.tmp', 'w')
+        for project in sorted(self.manifest):
+            for month in sorted(self.manifest[project]):
+                manifest_handler.write('%s %s %s\n' % (project, month,
+                    self.manifest[project][month]))
+        manifest_handler.close()
+        os.rename(manifest_file_path + '.tmp', manifest_file_path)
+
+
+    # Get the name of the page of a month
+    def _get_month_page(self, month):
+        '''
+        Get the name of the page of a month.
+        '''
+
+        return '%s-%s.html' % (month[:4], month[4:])
+
+
+    # Render the page of a month, containing its entries formatted in Debian
+    # Changelog Syntax
+    def _render_month(self, editor, month, entries):
+        '''
+        Render the page of a month, containing its entries formatted in Debian
+        Changelog Syntax.
+        '''
+
+        project = editor.config['project']
+        title = '%s %s-%s' % (editor.config.get('label', project), month[:4],
+            month[4:])
+
+        body = ['<p><a href="../index.html">index</a></p>']
+        for entry in entries:
+            body.append('<pre>%s</pre>' % cgi.escape(
+                editor.get_formatted_entry(entry)))
+
+        self._write_page(os.path.join(project, self._get_month_page(month)),
+            title, '\n'.join(body))
+
+
+    # Write a page (and its gzip compressed version) into the publish
+    # directory, replacing the old one only when it's completely written
+    def _write_page(self, page, title, body):
+        '''
+        Write a page (and its gzip compressed version) into the publish
+        directory, replacing the old one only when it's completely written.
+        '''
+
+        page_file_path = os.path.join(self.publish_dir, page)
+        if not os.path.exists(os.path.dirname(page_file_path)):
+            os.makedirs(os.path.dirname(page_file_path))
+
+        html = LOGBOOK_HTML % {'title': cgi.escape(title), 'body': body}
+        page_handler = open(page_file_path + '.tmp', 'w')
+        page_handler.write(html)
+        page_handler.close()
+        page_handler = gzip.open(page_file_path + '.gz.tmp', 'wb')
+        page_handler.write(html)
+        page_handler.close()
+
+        os.rename(page_file_path + '.tmp', page_file_path)
+        os.rename(page_file_path + '.gz.tmp', page_file_path + '.gz')
+
+
+# Class responsible for the attachments of the tasks. The attachments are
+# stored compressed and named by the digest of their content, so the same
+# content is stored only once, and the tasks have only a short reference
+class LogBookAttachments(object):
+    '''
+    Class responsible for the attachments of the tasks. The attachments are
+    stored compressed and named by the digest of their content, so the same
+    content is stored only once, and the tasks have only a short reference.
+    '''
+
+
+    # Pattern of the attachment references
+    reference_re = re.compile('\[attachment ([0-9a-f]{16}): [^\]]*\]')
+
+
+    # Initial setup based on the "config"
+    def __init__(self, config):
+        '''
+        Initial setup based on the "config".
+        '''
+
+        basedir = os.path.join(LOGBOOK_USERDIR, config['project'])
+        basedir = config.get('basedir', basedir)
+        self.attachments_dir = os.path.join(basedir, LOGBOOK_ATTACHMENTS)
+
+
+    # Store the content of a file. Return its reference
+    def store_file(self, file_name):
+        '''
+        Store the content of a file. Return its reference.
+        '''
+
+        file_handler = open(file_name)
+        content = file_handler.read()
+        file_handler.close()
+
+        return self.store(content, '%s, %d bytes' %
+            (os.path.basename(file_name), len(content)))
+
+
+    # Store a content, if it isn't stored yet. Return its reference, with a
+    # "description" of the content
+    def store(self, content, description):
+        '''
+        Store a content, if it isn't stored yet. Return its reference, with a
+        "description" of the content.
+        '''
+
+        digest = hashlib.sha256(content).hexdigest()[:16]
+        attachment_file_path = self._get_attachment_file_path(digest)
+
+        if not os.path.exists(attachment_file_path):
+            attachment_dir = os.path.dirname(attachment_file_path)
+            try:
+                os.makedirs(attachment_dir)
+            except OSError:
+                if not os.path.isdir(attachment_dir):
+                    raise
+
+            # each writer uses its own temporary file, the same content may
+            # be stored by many writers at the same time
+            fd, temp_file_path = tempfile.mkstemp(dir=attachment_dir)
+            os.fchmod(fd, 0644)
+            temp_handler = os.fdopen(fd, 'wb')
+            attachment_handler = gzip.GzipFile(attachment_file_path, 'wb',
+                fileobj=temp_handler)
+            attachment_handler.write(content)
+            attachment_handler.close()
+            temp_handler.close()
+            os.rename(temp_file_path, attachment_file_path)
+
+        return '[attachment %s: %s]' % (digest, description)
+
+
+    # Load the content of an attachment
+    def load(self, digest):
+        '''
+        Load the content of an attachment.
+        '''
+
+        try:
+            attachment_handler = gzip.open(
+                self._get_attachment_file_path(digest))
+        except IOError:
+            return '(attachment %s could not be found)' % digest
+
+        content = attachment_handler.read()
+        attachment_handler.close()
+        return content
+
+
+    # Get the path of the file of an attachment, inside a directory named by
+    # the first characters of the digest (to avoid huge directories)
+    def _get_attachment_file_path(self, digest):
+        '''
+        Get the path of the file of an attachment, inside a directory named by
+        the first characters of the digest (to avoid huge directories).
+        '''
+
+        return os.path.join(self.attachments_dir, digest[:2], digest[2:] +
+            '.gz')
+
+
+# Class responsible for the journals of a logfile. Each writer (an user on a
+# host) appends its updates to its own journal, what is cheap and safe even
+# for concurrent writers, and the journals are compacted into the logfile
+# later
+class LogBookJournal(object):
+    '''
+    Class responsible for the journals of a logfile. Each writer (an user on a
+    host) appends its updates to its own journal, what is cheap and safe even
+    for concurrent writers, and the journals are compacted into the logfile
+    later.
+    '''
+
+
+    # Initial setup based on the "config"
+    def __init__(self, config):
+        '''
+        Initial setup based on the "config".
+        '''
+
+        self.config = config
+        self.journal_dir = config['logfile'] + LOGBOOK_JOURNAL
+        self.journal_file_name = os.path.join(self.journal_dir, '%s@%s' %
+            (config['user'], socket.gethostname()))
+
+
+    # Append a message to the journal of the writer, as a new task of the
+    # current version. The author and the host default to the configured ones
+    def append(self, message, name=None, email=None, hostname=None):
+        '''
+        Append a message to the journal of the writer, as a new task of the
+        current version. The author and the host default to the configured ones.
+        '''
+
+        now = time.localtime()
+        task = '  * %s %s\n' % (time.strftime('%H:%M', now),
+            message.rstrip('\n'))
+        self.append_task(task, time.strftime('%Y%m%d', now),
+            name or self.config['name'], email or self.config['email'],
+            hostname or socket.gethostname(), time.mktime(now))
+
+
+    # Append a task (formatted as in the logfile) of a version to the journal
+    # of the writer
+    def append_task(self, task, version, name, email, hostname, now=None):
+        '''
+        Append a task (formatted as in the logfile) of a version to the journal
+        of the writer.
+        '''
+
+        if not os.path.exists(self.journal_dir):
+            os.mkdir(self.journal_dir)
+
+        # each update is a line with the time, the version, the author, the
+        # host and the task (all escaped, so a tab or a breakline doesn't
+        # break the line)
+        self._append(self.journal_file_name, '\t'.join([
+            repr(now or time.time())] + [v.encode('string_escape')
+            for v in (version, name, email, hostname, task)]) + '\n')
+
+
+    # Read the updates of all the journals. Return a dictionary with the
+    # complete updates of each journal (used to remove them later) and the
+    # updates as entries, sorted by version (the newest first)
+    def read(self):
+        '''
+        Read the updates of all the journals. Return a dictionary with the
+        complete updates of each journal (used to remove them later) and the
+        updates as entries, sorted by version (the newest first).
+        '''
+
+        journal_files, records = {}, []
+        if not os.path.isdir(self.journal_dir):
+            return journal_files, []
+
+        # read the journals, ignoring the incomplete update being written
+        for journal_file_name in glob.glob(self.journal_dir + '/*@*'):
+            try:
+                data = open(journal_file_name).read()
+            except IOError:
+                continue
+            lines = data[:data.rfind('\n') + 1].splitlines()
+            if lines:
+                journal_files[journal_file_name] = lines
+                records.extend([l.split('\t') for l in lines])
+
+        # group the updates by version and by author, the oldest first
+        entries = {}
+        records.sort(key=lambda r: float(r[0]))
+        for record in records:
+            now, version, name, email, hostname, task = [record[0]] + \
+                [v.decode('string_escape') for v in record[1:]]
+            if version not in entries:
+                entries[version] = {
+                    'label': self.config.get('label', self.config['project']),
+                    'version': version,
+                    'hostname': hostname,
+                    'name': name,
+                    'email': email,
+                    'attrs': ['urgency=low'],
+                    'tasks': {},
+                    'datetime': time.strftime('%a, %d %b %Y %H:%M:%S %z',
+                        time.localtime(float(now))),
+                    'names_order': [],
+                }
+            entry = entries[version]
+            if name not in entry['tasks']:
+                entry['tasks'][name] = []
+                entry['names_order'].append(name)
+            entry['tasks'][name].append(task)
+
+        # the last task of each author ends with a blank line
+        for entry in entries.values():
+            for name in entry['names_order']:
+                entry['tasks'][name][-1] += '\n'
+
+        return journal_files, sorted(entries.values(),
+            key=lambda e: e['version'], reverse=True)
+
+
+    # Remove the updates of the journals. Each journal is renamed and locked
+    # (waiting for its writers) before being removed, and the updates written
+    # after it was read are appended again to a new journal
+    def remove(self, journal_files):
+        '''
+        Remove the updates of the journals. Each journal is renamed and locked
+        (waiting for its writers) before being removed, and the updates written
+        after it was read are appended again to a new journal.
+        '''
+
+        for journal_file_name, lines in journal_files.iteritems():
+            removed_file_name = '%s.%d' % (journal_file_name, os.getpid())
+            try:
+                os.rename(journal_file_name, removed_file_name)
+            except OSError:
+                continue
+
+            journal_handler = open(removed_file_name)
+            fcntl.flock(journal_handler.fileno(), fcntl.LOCK_EX)
+            data = journal_handler.read()
+            journal_handler.close()
+            os.unlink(removed_file_name)
+
+            # only the updates which were read are removed, if the journal
+            # doesn't start with them it's another journal, kept completely
+            data = data.splitlines(True)
+            if [l.rstrip('\n') for l in data[:len(lines)]] == lines:
+                data = data[len(lines):]
+            for line in data:
+                self._append(journal_file_name, line)
+
+
+    # Append a line to a journal. The journal is locked (shared with the other
+    # writers) while the line is written and, if the journal was removed
+    # meanwhile, the line is written on a new journal
+    def _append(self, journal_file_name, line):
+        '''
+        Append a line to a journal. The journal is locked (shared with the other
+        writers) while the line is written and, if the journal was removed
+        meanwhile, the line is written on a new journal.
+        '''
+
+        while True:
+            fd = os.open(journal_file_name, os.O_WRONLY | os.O_APPEND |
+                os.O_CREAT, 0644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                try:
+                    current = os.stat(journal_file_name).st_ino
+                except OSError:
+                    current = None
+                if current == os.fstat(fd).st_ino:
+                    os.write(fd, line)
+                    return
+            finally:
+                os.close(fd)
+
+
+# Class responsible for the collector service. The collector receives updates
+# (tasks and entries) from many clients and stores them on the journals of
+# the projects, which are compacted into the logfiles periodically, so many
+# updates are committed at once. It also answers queries about the projects
+# using its in-memory index
+class LogBookCollector(object):
+    '''
+    Class responsible for the collector service. The collector receives updates
+    (tasks and entries) from many clients and stores them on the journals of
+    the projects, which are compacted into the logfiles periodically, so many
+    updates are committed at once. It also answers queries about the projects
+    using its in-memory index.
+    '''
+
+
+    # Interval, in seconds, between the compactions of the journals
+    compact_interval = 1.0
+
+
+    # Initial setup based on the service address, "HOST:PORT" or the path of
+    # an unix socket
+    def __init__(self, address):
+        '''
+        Initial setup based on the service address, "HOST:PORT" or the path of
+        an unix socket.
+        '''
+
+        self.lock = threading.Lock()
+        self.logbook = LogBook()
+        self.configs = {}
+        self.pending = {}
+        self.index = {}
+        self._update_index()
+
+        # create the server, removing an old unix socket if there is one (but
+        # never another kind of file)
+        family, address = _get_socket_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                if not stat.S_ISSOCK(os.stat(address).st_mode):
+                    raise RemoteError('"%s" already exists and it\'s not a '
+                        'socket.' % address)
+                os.unlink(address)
+            self.server = _LogBookUnixServer(address, _LogBookRequestHandler)
+        else:
+            self.server = _LogBookTCPServer(address, _LogBookRequestHandler)
+        self.server.collector = self
+
+
+    # Run the service until it's interrupted, compacting the journals of the
+    # updated projects periodically
+    def serve_forever(self):
+        '''
+        Run the service until it's interrupted, compacting the journals of the
+        updated projects periodically.
+        '''
+
+        server = threading.Thread(target=self.server.serve_forever)
+        server.daemon = True
+        server.start()
+
+        try:
+            while True:
+                time.sleep(self.compact_interval)
+                self.compact()
+        except KeyboardInterrupt:
+            self.server.shutdown()
+            self.compact()
+
+
+    # Compact the journals of the projects updated since the last compaction
+    def compact(self):
+        '''
+        Compact the journals of the projects updated since the last compaction.
+        '''
+
+        self.lock.acquire()
+        projects, self.pending = self.pending.keys(), {}
+        self.lock.release()
+
+        # a project that couldn't be compacted is tried again later, its
+        # updates are kept safe on the journal meanwhile, unless it was deleted
+        for project in projects:
+            try:
+                self.logbook.do_compact_project(project)
+            except ProjectDoesNotExistError, ex:
+                sys.stderr.write('Error: %s\n' % ex)
+                self.lock.acquire()
+                self.index.pop(project, None)
+                self.configs.pop(project, None)
+                self.lock.release()
+            except Exception, ex:
+                sys.stderr.write('Error: %s: %s\n' % (project, ex))
+                self.lock.acquire()
+                self.pending[project] = True
+                self.lock.release()
+            finally:
+                self.logbook._remove_temp_file()
+        if projects:
+            self._update_index()
+
+
+    # Handle a request, a dictionary containing the "action" and its arguments.
+    # Return the response dictionary
+    def handle(self, request):
+        '''
+        Handle a request, a dictionary containing the "action" and its arguments.
+        Return the response dictionary.
+        '''
+
+        # the values are strings, and the author and the host can't break the
+        # author and the footer lines of the logfile
+        if not isinstance(request, dict):
+            raise ValueError('the request is not an object.')
+        for key in ('action', 'project', 'message', 'text', 'name', 'email',
+                'hostname'):
+            value = request.get(key)
+            if value is None:
+                continue
+            elif not isinstance(value, basestring):
+                raise ValueError('"%s" is not a string.' % key)
+            elif key in ('project', 'name', 'email', 'hostname') and \
+                    re.search(r'[\t\r\n]', value):
+                raise ValueError('"%s" has tabs or breaklines.' % key)
+
+        action = request.get('action')
+        project = request.get('project')
+
+        # query the index of all the projects or of a single project
+        if action == 'query':
+            self.lock.acquire()
+            try:
+                if project:
+                    if project not in self.index:
+                        raise ProjectDoesNotExistError(
+                            'project "%s" could not be found.' % project)
+                    return {'status': 'ok', 'project': self.index[project]}
+                return {'status': 'ok', 'projects': self.index.values()}
+            finally:
+                self.lock.release()
+
+        journal = LogBookJournal(self._get_config(project))
+
+        # store a task, as the last task of the current entry
+        if action == 'task':
+            journal.append(request['message'], request.get('name'),
+                request.get('email'), request.get('hostname'))
+            tasks = 1
+
+        # store the tasks of the entries (in Debian Changelog Syntax)
+        elif action == 'entry':
+            tasks = 0
+            handler = StringIO.StringIO(request['text'])
+            handler.name = '<request>'
+            for entry in LogBookEditor.iter_entries(handler):
+                for name in entry['names_order']:
+                    for task in entry['tasks'][name]:
+                        journal.append_task(task.rstrip('\n') + '\n',
+                            entry['version'], name, entry['email'],
+                            entry['hostname'])
+                        tasks += 1
+        else:
+            return {'status': 'error', 'error': 'unknown action "%s".' %
+                action}
+
+        # the project will be compacted on the next compaction
+        self.lock.acquire()
+        self.pending[project] = True
+        if project in self.index:
+            self.index[project]['pending'] += tasks
+        self.lock.release()
+        return {'status': 'ok', 'tasks': tasks}
+
+
+    # Get the configuration of a project. The configuration is loaded again
+    # only if its files were changed, and the index is updated if the project
+    # isn't known yet (it may have been created after the service started)
+    def _get_config(self, project):
+        '''
+        Get the configuration of a project. The configuration is loaded again
+        only if its files were changed, and the index is updated if the project
+        isn't known yet (it may have been created after the service started).
+        '''
+
+        if project not in self.index:
+            self._update_index()
+            if project not in self.index:
+                raise ProjectDoesNotExistError(
+                    'project "%s" could not be found.' % project)
+
+        mtimes = []
+        for config_file_path in [os.path.join(LOGBOOK_USERDIR, 'config'),
+                os.path.join(LOGBOOK_USERDIR, project, 'config')]:
+            try:
+                mtimes.append(os.stat(config_file_path).st_mtime)
+            except OSError:
+                mtimes.append(None)
+
+        self.lock.acquire()
+        try:
+            if project not in self.configs or \
+                    self.configs[project][0] != mtimes:
+                self.configs[project] = mtimes, dict(
+                    LogBook().load_config(project))
+            return self.configs[project][1]
+        finally:
+            self.lock.release()
+
+
+    # Update the index of the projects from the registry, keeping the number
+    # of updates not compacted yet
+    def _update_index(self):
+        '''
+        Update the index of the projects from the registry, keeping the number
+        of updates not compacted yet.
+        '''
+
+        registry = LogBook().get_registry(refresh=True)
+        self.lock.acquire()
+        index = {}
+        for p in registry:
+            p = dict(p)
+            p['entries'] = int(p['entries'])
+            p['pending'] = 0
+            if p['project'] in self.pending and p['project'] in self.index:
+                p['pending'] = self.index[p['project']]['pending']
+            index[p['project']] = p
+        self.index = index
+        self.lock.release()
+
+
+# Request handler of the collector service. Each request (and its response)
+# is a line containing a JSON object, and a client may send many requests on
+# the same connection
+class _LogBookRequestHandler(SocketServer.StreamRequestHandler):
+    '''
+    Request handler of the collector service. Each request (and its response)
+    is a line containing a JSON object, and a client may send many requests on
+    the same connection.
+    '''
+
+
+    # Handle the requests of a connection
+    def handle(self):
+        '''
+        Handle the requests of a connection.
+        '''
+
+        for line in iter(self.rfile.readline, ''):
+            try:
+                response = self.server.collector.handle(
+                    _decode_json(json.loads(line)))
+            except KeyError, ex:
+                response = {'status': 'error', 'error': 'invalid request, '
+                    '"%s" is missing.' % ex.args[0]}
+            except ValueError, ex:
+                response = {'status': 'error', 'error': 'invalid request: %s' %
+                    ex}
+            except (ProjectDoesNotExistError, LogFileFormatError), ex:
+                response = {'status': 'error', 'error': str(ex)}
+            except Exception, ex:
+                sys.stderr.write('Error: %s\n' % ex)
+                response = {'status': 'error', 'error': 'internal error.'}
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+
+# Threaded TCP server of the collector service
+class _LogBookTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    '''
+    Threaded TCP server of the collector service.
+    '''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+# Threaded unix socket server of the collector service
+class _LogBookUnixServer(SocketServer.ThreadingMixIn,
+        SocketServer.UnixStreamServer):
+    '''
+    Threaded unix socket server of the collector service.
+    '''
+
+    daemon_threads = True
+
+
+# Get the socket family and address of a collector service address, which is
+# "HOST:PORT" or the path of an unix socket
+def _get_socket_address(address):
+    '''
+    Get the socket family and address of a collector service address, which is
+    "HOST:PORT" or the path of an unix socket.
+    '''
+
+    if ':' in address and not os.sep in address:
+        host, port = address.rsplit(':', 1)
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+# Convert the unicode strings of a decoded JSON object to UTF-8 strings, used
+# on the rest of the application
+def _decode_json(value):
+    '''
+    Convert the unicode strings of a decoded JSON object to UTF-8 strings, used
+    on the rest of the application.
+    '''
+
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, dict):
+        return dict([(str(k), _decode_json(v)) for k, v in value.items()])
+    elif isinstance(value, list):
+        return [_decode_json(v) for v in value]
+    return value
+
+
+# Send a request to a collector service and return its response
+def _call_collector(address, request):
+    '''
+    Send a request to a collector service and return its response.
+    '''
+
+    family, address = _get_socket_address(address)
+    try:
+        client = socket.socket(family, socket.SOCK_STREAM)
+        client.connect(address)
+        client_file = client.makefile('r+')
+        client_file.write(json.dumps(request) + '\n')
+        client_file.flush()
+        response = client_file.readline()
+        client_file.close()
+        client.close()
+    except socket.error, ex:
+        raise RemoteError('collector could not be reached: %s.' % ex)
+
+    if not response:
+        raise RemoteError('collector closed the connection.')
+    return _decode_json(json.loads(response))
+
+
+# Class responsible for recording the metrics of the application. The values
+# are recorded in memory and added to the values of the previous executions,
+# stored on a file, when the metrics are saved
+class LogBookMetrics(object):
+    '''
+    Class responsible for recording the metrics of the application. The values
+    are recorded in memory and added to the values of the previous executions,
+    stored on a file, when the metrics are saved.
+    '''
+
+
+    # Upper bounds of the histogram buckets, in seconds
+    buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+
+    # Initial setup, no values recorded
+    def __init__(self):
+        '''
+        Initial setup, no values recorded.
+        '''
+
+        self.counters = {}
+        self.histograms = {}
+
+
+    # Increment a counter
+    def inc(self, name, value=1, **labels):
+        '''
+        Increment a counter.
+        '''
+
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+
+    # Record a value in a histogram
+    def observe(self, name, value, **labels):
+        '''
+        Record a value in a histogram.
+        '''
+
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.setdefault(key,
+            {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0, 'count': 0})
+
+        # the last bucket is the "+Inf" one
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        histogram['buckets'][index] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+    # Load the metrics of the previous executions
+    def load(self, state_file_path):
+        '''
+        Load the metrics of the previous executions.
+        '''
+
+        try:
+            state_handler = open(state_file_path, 'rb')
+            try:
+                return cPickle.load(state_handler)
+            finally:
+                state_handler.close()
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return {'counters': {}, 'histograms': {}}
+
+
+    # Add the recorded values to the metrics of the previous executions and
+    # save them. The metrics file is locked while it's updated, so concurrent
+    # executions don't lose values, and replaced only when it's completely
+    # written. Return the saved metrics
+    def save(self, state_file_path):
+        '''
+        Add the recorded values to the metrics of the previous executions and
+        save them. The metrics file is locked while it's updated, so concurrent
+        executions don't lose values, and replaced only when it's completely
+        written. Return the saved metrics.
+        '''
+
+        state_dir = os.path.dirname(state_file_path)
+        if not os.path.isdir(state_dir):
+            os.mkdir(state_dir)
+
+        lock_handler = open(state_file_path + '.lock', 'w')
+        fcntl.flock(lock_handler.fileno(), fcntl.LOCK_EX)
+        try:
+            state = self.load(state_file_path)
+            for key, value in self.counters.iteritems():
+                state['counters'][key] = state['counters'].get(key, 0) + value
+            for key, histogram in self.histograms.iteritems():
+                saved = state['histograms'].setdefault(key, {'buckets':
+                    [0] * (len(self.buckets) + 1), 'sum': 0, 'count': 0})
+                saved['buckets'] = [a + b for a, b in zip(saved['buckets'],
+                    histogram['buckets'])]
+                saved['sum'] += histogram['sum']
+                saved['count'] += histogram['count']
+
+            fd, temp_file_path = tempfile.mkstemp(dir=state_dir)
+            state_handler = os.fdopen(fd, 'wb')
+            cPickle.dump(state, state_handler, cPickle.HIGHEST_PROTOCOL)
+            state_handler.close()
+            os.rename(temp_file_path, state_file_path)
+        finally:
+            lock_handler.close()
+
+        self.counters, self.histograms = {}, {}
+        return state
+
+
+    # Render the metrics and the "gauges" (a list of name, labels and value)
+    # in the Prometheus text format
+    def render(self, state, gauges=[]):
+        '''
+        Render the metrics and the "gauges" (a list of name, labels and value)
+        in the Prometheus text format.
+        '''
+
+        # get the samples of each metric
+        samples = {}
+        for (name, labels), value in state['counters'].iteritems():
+            samples.setdefault(name, []).append((name, labels, value))
+        for (name, labels), histogram in state['histograms'].iteritems():
+            count = 0
+            for bound, value in zip(self.buckets + ['+Inf'],
+                    histogram['buckets']):
+                count += value
+                samples.setdefault(name, []).append((name + '_bucket',
+                    labels + (('le', str(bound)),), count))
+            samples[name].append((name + '_sum', labels, histogram['sum']))
+            samples[name].append((name + '_count', labels, histogram['count']))
+        for name, labels, value in gauges:
+            samples.setdefault(name, []).append((name,
+                tuple(sorted(labels.items())), value))
+
+        # render the samples, grouped by metric
+        text = []
+        for name in sorted(samples):
+            type, help = LOGBOOK_METRICS_HELP[name]
+            text.append('# HELP %s %s' % (name, help))
+            text.append('# TYPE %s %s' % (name, type))
+            for sample, labels, value in samples[name]:
+                labels = ','.join(['%s="%s"' % (k, str(v).replace('\\',
+                    '\\\\').replace('"', '\\"')) for k, v in labels])
+                text.append('%s{%s} %r' % (sample, labels, value))
+
+        return '\n'.join(text) + '\n'
+
+
+# Verify the hash chain of a project. It's a module function, so it can be
+# used by the processes of a "multiprocessing.Pool"
+def _verify_project_chain(args):
+    '''
+    Verify the hash chain of a project. It's a module function, so it can be
+    used by the processes of a "multiprocessing.Pool".
+    '''
+
+    project, full = args
+    problems, verified = LogBook().verify_project(project, full)
+    return project, problems, verified